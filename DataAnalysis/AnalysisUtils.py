@@ -35,7 +35,7 @@ from StructureLearning.RLCD.RLCD_alg import RLCD
 from utils.Chi2RankTest import Chi2RankTest
 from DGM.DataModel import DataModel
 
-def run_RLCD_on_data(df_x, sample = 1, alpha = 0.01, rank_test_N_scaling = 1, stage1_method = "all", stage1_ges_sparsity = 2, stage1_partition_thres = 3):
+def run_RLCD_on_data(df_x, sample = 1, alpha = 0.01, rank_test_N_scaling = 1, stage1_method = "all", stage1_ges_sparsity = 2, stage1_partition_thres = 3, ordinal = False):
     """
     Runs the RLCD algorithm on the given data and returns the adjacency matrix.
     
@@ -44,6 +44,7 @@ def run_RLCD_on_data(df_x, sample = 1, alpha = 0.01, rank_test_N_scaling = 1, st
         # output_path is removed from here
         sample: A boolean indicating whether to use sampling (non-oracle) or not.
         alpha: The alpha value for statistical tests.
+        ordinal: If True, rank tests use the polychoric correlation matrix of the data.
         ... (other parameters) ...
 
     Returns:
@@ -55,8 +56,13 @@ def run_RLCD_on_data(df_x, sample = 1, alpha = 0.01, rank_test_N_scaling = 1, st
         df_x  = df_x[xvars].copy()      
         dgm_object = DataModel(df_x, df_x) 
 
+        if ordinal:
+            ranktest_method = Chi2RankTest.from_ordinal(df_x.to_numpy(), rank_test_N_scaling)
+        else:
+            ranktest_method = Chi2RankTest(df_x.to_numpy(), rank_test_N_scaling)
+
         input_parameters = {
-            "ranktest_method": Chi2RankTest(df_x.to_numpy(), rank_test_N_scaling),
+            "ranktest_method": ranktest_method,
             "citest_method": None,
             "stage1_method": stage1_method,
             "alpha_dict": {0: alpha, 1: alpha, 2: alpha, 3: alpha},
@@ -19,7 +19,7 @@ from StructureLearning.RLCD.RLCD_alg import RLCD
 from utils.Chi2RankTest import Chi2RankTest
 from DGM.DataModel import DataModel
 
-def run_causal_discovery_on_data(input_path, sample = 1, alpha = 0.01, rank_test_N_scaling = 1, stage1_method = "all", stage1_ges_sparsity = 2, stage1_partition_thres = 3):
+def run_causal_discovery_on_data(input_path, sample = 1, alpha = 0.01, rank_test_N_scaling = 1, stage1_method = "all", stage1_ges_sparsity = 2, stage1_partition_thres = 3, ordinal = False, time_budget = None):
     """
     Runs the RLCD algorithm on the given data and returns the adjacency matrix.
     
@@ -28,6 +28,8 @@ def run_causal_discovery_on_data(input_path, sample = 1, alpha = 0.01, rank_test
         # output_path is removed from here
         sample: A boolean indicating whether to use sampling (non-oracle) or not.
         alpha: The alpha value for statistical tests.
+        ordinal: If True, rank tests use the polychoric correlation matrix of the data.
+        time_budget: Seconds after which RLCD stops and returns the structure found so far.
         ... (other parameters) ...
 
     Returns:
@@ -42,15 +44,22 @@ def run_causal_discovery_on_data(input_path, sample = 1, alpha = 0.01, rank_test
     
     if sample:
         dgm_object = DataModel(df_x, df_x)
+        if ordinal:
+            ranktest_method = Chi2RankTest.from_ordinal(df_x.to_numpy(), rank_test_N_scaling)
+        else:
+            ranktest_method = Chi2RankTest(df_x.to_numpy(), rank_test_N_scaling)
         input_parameters = {
-            "ranktest_method": Chi2RankTest(df_x.to_numpy(), rank_test_N_scaling),
+            "ranktest_method": ranktest_method,
             "citest_method": None,
             "stage1_method": stage1_method,
             "alpha_dict": {0: alpha, 1: alpha, 2: alpha, 3: alpha},
             "stage1_ges_sparsity": stage1_ges_sparsity,
-            "stage1_partition_thres": stage1_partition_thres
+            "stage1_partition_thres": stage1_partition_thres,
+            "time_budget": time_budget
         }
-        _, _, estimated_adj_numpy, all_vars = RLCD(sample, dgm_object.xvars, df_x, input_parameters)
+        _, _, estimated_adj_numpy, all_vars, truncated = RLCD(sample, dgm_object.xvars, df_x, input_parameters, return_truncated=True)
+        if truncated:
+            print(f"RLCD truncated: time budget of {time_budget}s reached, saving the structure found so far")
     else:
         print(f"Need true DGM.")
         return None, None
@@ -63,13 +72,17 @@ if __name__ == "__main__":
     parser.add_argument("input_path", type=str, help="Path to the input data CSV file.")
     parser.add_argument("output_path", type=str, help="Path to save the output adjacency matrix CSV.")
     parser.add_argument("alpha", type=float, help="The alpha level for the statistical tests.")
+    parser.add_argument("--ordinal", action="store_true", help="Treat the data as ordinal and use polychoric correlations.")
+    parser.add_argument("--time_budget", type=float, default=None, help="Stop RLCD after this many seconds and save the structure found so far.")
     args = parser.parse_args()
 
     # Get the estimated adjacency matrix and variable names
     # Corrected function call using keyword arguments
     estimated_adj_numpy, all_vars = run_causal_discovery_on_data(
         input_path=args.input_path,
-        alpha=args.alpha
+        alpha=args.alpha,
+        ordinal=args.ordinal,
+        time_budget=args.time_budget
     )
 
     # Convert to DataFrame with names and save it to the specified output path
@@ -5,6 +5,7 @@ import sys
 from itertools import combinations
 import os
 import copy
+from collections import deque
 
 class LinearSCM(object):
     def __init__(self, seed=0):
@@ -192,6 +193,95 @@ class LinearSCM(object):
         cross_cov = cov[np.ix_(pcols, qcols)]
         return np.linalg.matrix_rank(cross_cov)
 
+    def trek_separation_rank_by_idx_in_xvars(self, pcols, qcols):
+        """
+        Generic rank of the cross covariance [pcols, qcols], i.e. the minimum
+        size of a set (C_A, C_B) t-separating the two sets of variables
+        (Sullivant, Talaska and Draisma, 2010). Computed as a max-flow on the
+        DAG in self.F, so it does not depend on the coefficient values and
+        cannot be fooled by near cancellations. Results are memoized for as
+        long as the edge pattern of F is unchanged.
+        """
+        pattern = (self.F!=0).tobytes()
+        if getattr(self, '_trek_pattern', None)!=pattern:
+            self._trek_pattern = pattern
+            self._trek_flow_graph = self._build_trek_flow_graph()
+            self._trek_rank_cache = {}
+
+        pcols = [self.vars.index(self.xvars[idx]) for idx in pcols]
+        qcols = [self.vars.index(self.xvars[idx]) for idx in qcols]
+
+        key = (tuple(sorted(pcols)), tuple(sorted(qcols)))
+        if key not in self._trek_rank_cache:
+            self._trek_rank_cache[key] = self._trek_max_flow(pcols, qcols)
+
+        return self._trek_rank_cache[key]
+
+    def _build_trek_flow_graph(self):
+        """
+        Flow network whose source-sink paths are the treks of the DAG: an 'up'
+        copy of every variable walks edges backwards from the left end to the
+        top of the trek, a 'down' copy walks forwards to the right end. Each
+        copy is split into in/out nodes with unit capacity, so a min cut is a
+        minimal t-separating set.
+
+        Nodes of variable i: up_in=i, up_out=n+i, down_in=2n+i, down_out=3n+i.
+        Returns {node: {node: capacity}}.
+        """
+        n = len(self.vars)
+        inf = n+1 # more than any flow
+        G = {u: {} for u in range(4*n)}
+        for i in range(n):
+            G[i][n+i] = 1
+            G[2*n+i][3*n+i] = 1
+            G[n+i][2*n+i] = inf # top of the trek
+
+        for pa, ch in zip(*np.nonzero(self.F)):
+            pa, ch = int(pa), int(ch)
+            G[n+ch][pa] = inf
+            G[3*n+pa][2*n+ch] = inf
+
+        return G
+
+    def _trek_max_flow(self, pcols, qcols):
+        """
+        Max-flow from the up copies of pcols to the down copies of qcols by
+        BFS augmenting paths (at most min(|pcols|, |qcols|) of them).
+        """
+        n = len(self.vars)
+        inf = n+1
+        source, sink = 4*n, 4*n+1
+
+        residual = {u: dict(nbrs) for u, nbrs in self._trek_flow_graph.items()}
+        residual[source] = {i: inf for i in pcols}
+        residual[sink] = {}
+        for j in qcols:
+            residual[3*n+j][sink] = inf
+
+        flow = 0
+        while True:
+            parent = {source: None}
+            queue = deque([source])
+            while len(queue)>0 and sink not in parent:
+                u = queue.popleft()
+                for v, c in residual[u].items():
+                    if c>0 and v not in parent:
+                        parent[v] = u
+                        queue.append(v)
+            if sink not in parent:
+                return flow
+
+            path = []
+            v = sink
+            while parent[v] is not None:
+                path.append((parent[v], v))
+                v = parent[v]
+            bottleneck = min(residual[u][v] for u, v in path)
+            for u, v in path:
+                residual[u][v] -= bottleneck
+                residual[v][u] = residual[v].get(u, 0) + bottleneck
+            flow += bottleneck
+
     # Test all possible combinations of subcovariance rank test
     def all_rank_tests(self):
         all_rank_test_result = {}
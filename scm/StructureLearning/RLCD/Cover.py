@@ -1,5 +1,31 @@
 from __future__ import annotations
-from itertools import combinations
+
+# Variable name -> bit, shared by the Covers of this process
+_VAR_INDEX = {}
+# Interned variable sets: frozenset of names -> (names, bitmask, hash).
+# Equal variable sets share one frozenset, bitmask and hash.
+_INTERNED = {}
+
+
+def internVars(varnames):
+    """
+    The interned (vars, bits, hash) of a collection of variable names.
+    """
+    key = _INTERNED.get(varnames) if isinstance(varnames, frozenset) else None
+    if key is None:
+        varnames = frozenset(varnames)
+        key = _INTERNED.get(varnames)
+    if key is None:
+        bits = 0
+        for x in varnames:
+            i = _VAR_INDEX.get(x)
+            if i is None:
+                i = len(_VAR_INDEX)
+                _VAR_INDEX[x] = i
+            bits |= 1 << i
+        key = (varnames, bits, hash("".join(sorted(varnames))))
+        _INTERNED[varnames] = key
+    return key
 
 
 class Cover:
@@ -16,20 +42,22 @@ class Cover:
     introduced not because a rank deficiency was found but because we had to
     introduce a temporary root variable to connect the remaining variables
     when no more rank deficient sets may be found.
+
+    vars is an interned frozenset, with its bitmask over the variable index
+    of the process in bits; set comparisons between Covers use the bitmasks.
     """
 
+    __slots__ = ('vars', 'bits', '_hash', 'atomic', 'temp', 'is_observed', 'is_leaf')
+
     def __init__(self, varnames, atomic=True, temp=False, is_observed=True, is_leaf=None):
         if isinstance(varnames, str):
-            self.vars = set([varnames])
-
-        elif isinstance(varnames, list):
-            self.vars = set(varnames)
+            varnames = [varnames]
 
-        elif isinstance(varnames, set):
-            self.vars = varnames
-        else:
+        elif not isinstance(varnames, (list, set, frozenset)):
             raise ValueError(f"{varnames} is neither str, list, set.")
 
+        self.vars, self.bits, self._hash = internVars(varnames)
+
        # if len(self.vars) > 0:
        #     v = next(iter(self.vars))
        #     self.type = v[:1]
@@ -42,16 +70,23 @@ class Cover:
     def __eq__(self, other):
         if not isinstance(other, Cover):
             return NotImplemented
-        return self.vars == other.vars
+        return self.bits == other.bits
 
     # The set of variables in any minimalGroup should be unique
     def __hash__(self):
-        s = "".join(sorted(list(self.vars)))
-        return hash(s)
+        return self._hash
+
+    # bitmasks and string hashes are per process: pickles carry the names
+    def __getstate__(self):
+        return (set(self.vars), self.atomic, self.temp, self.is_observed, self.is_leaf)
+
+    def __setstate__(self, state):
+        varnames, self.atomic, self.temp, self.is_observed, self.is_leaf = state
+        self.vars, self.bits, self._hash = internVars(varnames)
 
     # Union with another Cover
     def union(self, L):
-        self.vars = self.vars.union(L.vars)
+        self.vars, self.bits, self._hash = internVars(self.vars | L.vars)
 
     def __len__(self):
         return len(self.vars)
@@ -79,17 +114,19 @@ class Cover:
 
     def isSubset(self, Bs: set[Cover] | Cover, strict=False):
         if isinstance(Bs, set):
-            Bvars = getVars(Bs)
+            Bbits = getBits(Bs)
         elif isinstance(Bs, Cover):
-            Bvars = Bs.vars
+            Bbits = Bs.bits
         else:
             raise ValueError("Argument must be set of Covers or Cover.")
-        if strict:
-            return self.vars < Bvars
-        return self.vars <= Bvars
+        if self.bits & ~Bbits:
+            return False
+        return not strict or self.bits != Bbits
 
     def intersection(self, B):
-        return self.vars.intersection(B.vars)
+        if self.bits & B.bits == 0:
+            return set()
+        return set(self.vars & B.vars)
 
 
 ##################################
@@ -97,34 +134,41 @@ class Cover:
 ##################################
 
 
+def getBits(As: set[Cover]):
+    """
+    Bitmask of all variables of a set of Covers.
+    """
+    bits = 0
+    for A in As:
+        bits |= A.bits
+    return bits
+
+
 def setLength(Vs: set[Cover]):
     """
     Determine ||Vs||
     """
     assert not isinstance(Vs, str), "Cannot be string."
-    return len(getVars(Vs))
+    return bin(getBits(Vs)).count("1")
 
 
 def setDifference(As: set[Cover], Bs: set[Cover]):
-    diff = As - Bs  # first remove any common elements
-    newset = set()
-    while len(diff) > 0:
-        A = diff.pop()
-        newset.add(A)
-        for B in Bs:
-            if len(A.intersection(B)) > 0:
-                newset.remove(A)
-                break
-    return newset
+    """
+    The Covers of As sharing no variable with Bs.
+    """
+    Bbits = getBits(Bs)
+    return set([A for A in As - Bs if A.bits & Bbits == 0])
 
 
 def setOverlap(As: set[Cover], Bs: set[Cover]):
     if len(As.intersection(Bs)) > 0:
         return True
-    return len(setIntersection(As, Bs)) > 0
+    return getBits(As) & getBits(Bs) != 0
 
 
 def setIntersection(As: set[Cover], Bs: set[Cover]):
+    if getBits(As) & getBits(Bs) == 0:
+        return set()
     Avars = getVars(As)
     Bvars = getVars(Bs)
     return Avars.intersection(Bvars)
@@ -153,10 +197,7 @@ def getOrderedVarsString(As: set[Cover]|Cover):
         assert isinstance(A, Cover), "Argument should be a set of Covers."
         vars.update(A.vars)
 
-    vars = [x for x in vars]
-    vars.sort()
-
-    return " ".join(vars)
+    return " ".join(sorted(vars))
 
 def deduplicate(Vs: set[Cover]):
     """
@@ -164,9 +205,10 @@ def deduplicate(Vs: set[Cover]):
     """
     newVs = set()
     for Vi in Vs:
+        isDuplicate = False
         for Vj in Vs:
-            isDuplicate = False
-            if Vi.vars < Vj.vars:
+            # Vi.vars < Vj.vars
+            if Vi.bits & ~Vj.bits == 0 and Vi.bits != Vj.bits:
                 isDuplicate = True
                 break
         if not isDuplicate:
@@ -179,8 +221,9 @@ def pairwiseOverlap(Vs: set[Cover]):
     For each pair A, B in Vs, check if there are any variables overlapping.
     Return True if so.
     """
-    for pair in combinations(Vs, 2):
-        A, B = list(pair)
-        if len(A.vars.intersection(B.vars)) > 0:
+    seen = 0
+    for V in Vs:
+        if V.bits & seen:
             return True
+        seen |= V.bits
     return False
@@ -15,6 +15,9 @@ import numpy as np
 
 # Class to store discovered latent groups
 class LatentGroups:
+    # verify parent_index against latentDict on every findParents, for tests
+    check_parent_index = False
+
     def __init__(self, X, Xns, all_nb_set, nb_set_dict, local_Adj):# X_ns is a list of potential observed non sink variables
         self.i = 1
         self.X = set([Cover(x, is_observed=True) for x in X])
@@ -35,9 +38,88 @@ class LatentGroups:
 
         self.local_Adj = local_Adj
         self.x_list_for_local_Adj = X
+        self.setLocalNeighbourBits()
+
+        # variable name -> bit, for the measured-descendant cache
+        self.var_index = {}
+        self.var_names = []
+        self.resetStructureCache()
+
+        # child -> set of the latentDict keys having it in their children
+        self.parent_index = {}
+
+    def __getstate__(self):
+        # copies start with empty structure caches: deepcopies are often
+        # modified through latentDict directly
+        state = self.__dict__.copy()
+        state['measure_cache'] = {}
+        state['nonatomic_bits'] = None
+        state['reach_cache'] = {}
+        return state
+
+    def setLocalNeighbourBits(self):
+        """
+        Per observed variable, the bitmask of its neighbours in local_Adj
+        (either direction), with name -> index in x_list_for_local_Adj.
+        """
+        self.local_Adj_index = {x: i for i, x in enumerate(self.x_list_for_local_Adj)}
+        adjacent = (self.local_Adj != 0) | (self.local_Adj.T != 0)
+        self.local_nb_bits = []
+        for i in range(len(self.x_list_for_local_Adj)):
+            bits = 0
+            for j in np.flatnonzero(adjacent[i]):
+                if j != i:
+                    bits |= 1 << int(j)
+            self.local_nb_bits.append(bits)
+
+    def isLocallyConnected(self, xs):
+        """
+        Whether the observed variables xs form one connected component of
+        local_Adj restricted to xs, by a BFS over the neighbour bitmasks.
+        False for an empty xs.
+        """
+        target = 0
+        for x in xs:
+            target |= 1 << self.local_Adj_index[x]
+        if target == 0:
+            return False
+
+        reached = target & -target
+        frontier = reached
+        while frontier:
+            i = frontier.bit_length() - 1
+            frontier &= ~(1 << i)
+            new = self.local_nb_bits[i] & target & ~reached
+            reached |= new
+            frontier |= new
+        return reached == target
+
+    def localDensity(self, xs):
+        """
+        Fraction of the pairs of observed variables xs adjacent in local_Adj;
+        1 for fewer than two variables.
+        """
+        target = 0
+        for x in xs:
+            target |= 1 << self.local_Adj_index[x]
+        n = bin(target).count('1')
+        if n < 2:
+            return 1.0
+
+        edges = 0
+        bits = target
+        while bits:
+            i = bits.bit_length() - 1
+            bits &= ~(1 << i)
+            edges += bin(self.local_nb_bits[i] & target).count('1')
+        return edges / (n * (n - 1))
+
+    def isLocallyConnectedBatch(self, xs_list):
+        return [self.isLocallyConnected(xs) for xs in xs_list]
 
     def update_X_dict(self):# need to update whenever X changes
         self.X_dict = {x.takeOne():x for x in self.X}
+        self.resetStructureCache()
 
     def get_observed_cover_by_str(self, str):
         if str in self.X_dict:
@@ -291,18 +373,20 @@ class LatentGroups:
         assert not (
             atomic and non_atomic
         ), "Can only specify atomic or non_atomic, not both."
+        if self.check_parent_index:
+            self.checkParentIndex()
+
         parents = set()
         if isinstance(Vs, Cover):
             Vs = set([Vs])
 
-        for parent, values in self.latentDict.items():
-            if atomic and not parent.isAtomic:
-                continue
-            if non_atomic and parent.isAtomic:
-                continue
-            for V in Vs:
-                if V in values["children"]:
-                    parents.add(parent)
+        for V in Vs:
+            for parent in self.parent_index.get(V, ()):
+                if atomic and not parent.isAtomic:
+                    continue
+                if non_atomic and parent.isAtomic:
+                    continue
+                parents.add(parent)
         parents = deduplicate(parents)
 
         if non_atomic and len(Vs) == 1:
@@ -311,6 +395,38 @@ class LatentGroups:
             ), f"{next(iter(Vs))} should not have more than one non-atomic parent."
         return parents
 
+    def indexChildren(self, parent, children):
+        for C in children:
+            self.parent_index.setdefault(C, set()).add(parent)
+
+    def unindexChildren(self, parent, children):
+        for C in children:
+            parents = self.parent_index.get(C)
+            if parents is not None:
+                parents.discard(parent)
+                if len(parents) == 0:
+                    self.parent_index.pop(C)
+
+    def rebuildParentIndex(self):
+        """
+        Rebuild parent_index from latentDict, after changes made to
+        latentDict directly.
+        """
+        self.parent_index = {}
+        for parent, values in self.latentDict.items():
+            self.indexChildren(parent, values["children"])
+
+    def checkParentIndex(self):
+        """
+        Assert that parent_index matches the children recorded in latentDict.
+        """
+        expected = {}
+        for parent, values in self.latentDict.items():
+            for C in values["children"]:
+                expected.setdefault(C, set()).add(parent)
+        assert expected == self.parent_index, \
+            f"parent_index out of date: {[C for C in set(expected) | set(self.parent_index) if expected.get(C) != self.parent_index.get(C)]}"
+
     def findAtomicParent(self, L):
         """
         Find the atomic parent of L.
@@ -381,13 +497,15 @@ class LatentGroups:
         # Get the atomicSuperCover of L and remove it
         # e.g. if L=L1 and {L1, L2} is also atomic, we must remove {L1, L2}.
         L = self.findAtomicSuperCover(L)
+        self.resetStructureCache()
 
         # Remove all subsets of L which are also AtomicGroups
         # e.g. {L1, L2} is atomic, and L1 is atomic, so remove both {L1, L2}
         # and L1 from latentDict
         subsets = self.subsets(L)
         for subset in subsets:
-            self.latentDict.pop(subset)
+            self.unindexChildren(subset, self.latentDict.pop(subset)["children"])
+            self.parent_index.pop(subset, None)
 
         for k in self.latentDict.keys():
             self.latentDict[k]["subcovers"] -= subsets
@@ -400,6 +518,8 @@ class LatentGroups:
         #      then we only remove {L1, L2} as a Cover but allow L2 to remain.
         nonAtomics, latentDict = self.findNonAtomics(L)
         self.latentDict = latentDict
+        for Lp, value in nonAtomics.items():
+            self.unindexChildren(Lp, value["children"])
 
     def findNonAtomics(self, L):
         """
@@ -447,6 +567,7 @@ class LatentGroups:
         L = self.findAtomicSuperCover(L)
 
         LOGGER.info(f"dissolveNode {L}...")
+        self.resetStructureCache()
 
         # Remove L and parent
         #printGraph(self)
@@ -479,11 +600,14 @@ class LatentGroups:
 
     # Disconnect all linkages between parent and children
     def disconnectNodes(self, parents, children, bidirectional=False):
+        self.resetStructureCache()
         for parent in parents:
+            self.unindexChildren(parent, self.latentDict[parent]["children"] & children)
             self.latentDict[parent]["children"] -= children
         if bidirectional:
             # Remove edges in the other direction as well
             for child in children:
+                self.unindexChildren(child, self.latentDict[child]["children"] & parents)
                 self.latentDict[child]["children"] -= parents
 
     # Check if a latent has already been refined
@@ -640,11 +764,15 @@ class LatentGroups:
         #assert not child.is_observed, "Child is not latent"
         # print(f"Reversing parentage! Parent:{parent} Child:{child}")
 
+        self.resetStructureCache()
+
         # Remove child as a child of parent
         self.latentDict[parent]["children"] -= set([child])
+        self.unindexChildren(parent, [child])
 
         # Add parent as a child of child
         self.latentDict[child]["children"].add(parent)
+        self.indexChildren(child, [parent])
 
     # Recursive function for use in makeRoot
     def makeRootRecursive(self, Ls, G=None):
@@ -681,6 +809,8 @@ class LatentGroups:
         assert isinstance(L, Cover), f"{L} must be a Cover."
         G = self.makeRootRecursive(set([L]))
         self.latentDict = G.latentDict
+        self.resetStructureCache()
+        self.rebuildParentIndex()
         self.activeSet = set([L])
 
     # Find all Groups that are a superset of L
@@ -742,10 +872,17 @@ class LatentGroups:
 
     def findChildren(self, L: Cover, rigorous=True):
         """
-        Recursive search for all immediate children of an atomic Cover
+        Recursive search for all immediate children of an atomic Cover.
+        Cached until the next change of latentDict.
         """
-        # everything is recorded in latentDict
         assert L is not None, "Should not look for None."
+        key = ('children', L, rigorous)
+        if key not in self.reach_cache:
+            self.reach_cache[key] = frozenset(self._findChildren(L, rigorous))
+        return set(self.reach_cache[key])
+
+    def _findChildren(self, L: Cover, rigorous=True):
+        # everything is recorded in latentDict
         #assert L.isAtomic, f"{L} should be an atomic Cover."
         #assert not L.isLeaf, f"{L} should be NonLeaf."
         children = set()
@@ -764,12 +901,19 @@ class LatentGroups:
             #        children = children | self.findChildren(subcover, rigorous)
 
             for key in self.latentDict.keys():
-                if len(set.intersection(L.vars, key.vars))!=0:
+                if L.bits & key.bits != 0:
                     children = children | self.latentDict[key]["children"]
 
             return children
 
     def findDescendants(self, L: Cover, rigorous=True):
+        """
+        The closure of findChildren from L, cached until the next change of
+        latentDict.
+        """
+        key = ('descendants', L, rigorous)
+        if key in self.reach_cache:
+            return set(self.reach_cache[key])
 
         descendants = set()
         children = self.findChildren(L, rigorous=rigorous)
@@ -778,6 +922,7 @@ class LatentGroups:
         for ch in children:
             descendants |= self.findDescendants(ch, rigorous=rigorous)
 
+        self.reach_cache[key] = frozenset(descendants)
         return descendants
 
     def findMeassuredSubset(self, L: Cover):
@@ -844,61 +989,108 @@ class LatentGroups:
         self.connectNodes(set([L]), grandchildren)  # Connect to grandchild
 
     def pickAllMeasures(self, Ls):
-        visitedA, visitedNA, measures = self._pickAllMeasures(Ls)
-        return measures
-
-    def _pickAllMeasures(self, Ls, visitedA=set(), visitedNA=set(), measures=set()):
         """
         Given a set of latent Covers, get all the measured descendants.
         This includes descendants of non-atomic covers.
         """
-        visitedA = visitedA.copy()
-        visitedNA = visitedNA.copy()
-        measures = measures.copy()
-        Q = deque()  # FIFO queue for BFS
+        return set(self.getMeasureCover(x) for x in self.bitsToNames(self.pickAllMeasureBits(Ls)))
+
+    def getMeasureCover(self, x):
+        if x in self.X_dict:
+            return self.X_dict[x]
+        return Cover(x, is_observed=True)
+
+    def resetStructureCache(self):
+        """
+        Drop the caches derived from latentDict: measured descendants,
+        children and descendants. Called by every method changing latentDict
+        or X.
+        """
+        self.measure_cache = {}
+        self.nonatomic_bits = None
+        self.reach_cache = {}
+
+    def varBits(self, names):
+        bits = 0
+        for x in names:
+            i = self.var_index.get(x)
+            if i is None:
+                i = len(self.var_names)
+                self.var_index[x] = i
+                self.var_names.append(x)
+            bits |= 1 << i
+        return bits
+
+    def bitsToNames(self, bits):
+        names = []
+        while bits:
+            i = bits.bit_length() - 1
+            bits &= ~(1 << i)
+            names.append(self.var_names[i])
+        return names
+
+    def coverMeasureBits(self, L):
+        """
+        (variables of the atomic covers visited, measured descendants) of L
+        by a BFS over atomic children, as bitsets over var_index. Cached
+        until the next change of latentDict.
+        """
+        entry = self.measure_cache.get(L)
+        if entry is not None:
+            return entry
+
+        if L.is_observed:
+            entry = (0, self.varBits(L.vars))
+        else:
+            visited = 0
+            measures = 0
+            seen = set([L])
+            Q = deque([L])  # FIFO queue for BFS
+            while len(Q) > 0:
+                V = Q.popleft()
+                visited |= self.varBits(V.vars)
+                measures |= self.varBits([x for x in V.vars if x in self.X_dict])
+                for C in self.findChildren(V):
+                    if C.is_observed:
+                        measures |= self.varBits(C.vars)
+                    elif C not in seen:
+                        seen.add(C)
+                        Q.append(C)
+            entry = (visited, measures)
+
+        self.measure_cache[L] = entry
+        return entry
+
+    def pickAllMeasureBits(self, Ls):
+        """
+        Bitset over var_index of the measured descendants of Ls, see
+        pickAllMeasures: the union of the cached descendants of each Cover,
+        plus the children of every non-atomic cover whose atomic covers have
+        all been visited, until no more are.
+        """
+        visited = 0
+        measures = 0
         for L in Ls:
-            if L.is_observed:
-                measures.add(L)
-            else:
-                for l_str in L.vars:
-                    temp = self.get_observed_cover_by_str(l_str)
-                    if temp is not None:
-                        measures.add(temp)
-                Q.append(L)
-
-        # BFS amongst atomic descendants of Ls
-        while len(Q) > 0:
-            L = Q.popleft()
-            visitedA.add(L)
-
-            for C in self.findChildren(L):
-                if C.is_observed:
-                    measures.add(C)
-                else:
-                    for C_str in C.vars:
-                        temp = self.get_observed_cover_by_str(C_str)
-                        if temp is not None:
-                            measures.add(temp)
-                    Q.append(C)
+            v, m = self.coverMeasureBits(L)
+            visited |= v
+            measures |= m
 
-        # Now check if the visited nodes contain non-atomic covers
-        # If yes, do DFS on the children of each non-atomic cover
-        for cover in self.latentDict:
-            if cover.isAtomic or (cover in visitedNA):
-                continue
-            if cover.isSubset(visitedA):
-                visitedNA.add(cover)
-                Cs = set()
+        if self.nonatomic_bits is None:
+            self.nonatomic_bits = [(self.varBits(cover.vars), cover) for cover in self.latentDict if not cover.isAtomic]
+
+        pending = self.nonatomic_bits
+        while True:
+            reached = [cover for bits, cover in pending if bits & ~visited == 0]
+            if len(reached) == 0:
+                break
+            pending = [(bits, cover) for bits, cover in pending if bits & ~visited != 0]
+            for cover in reached:
                 for C in self.latentDict[cover]["children"]:
-                    if C.is_observed:
-                        measures.add(C)
-                    else:
-                        Cs.add(C)
-                visitedA, visitedNA, measures = self._pickAllMeasures(
-                    Cs, visitedA, visitedNA, measures
-                )
+                    v, m = self.coverMeasureBits(C)
+                    visited |= v
+                    measures |= m
 
-        return visitedA, visitedNA, measures
+        return measures
 
     def saveLatentGroup(self, path):
         with open(path, "wb") as f:
@@ -914,12 +1106,16 @@ class LatentGroups:
         
         subcovers = self.findSubcovers(L)
         L.atomic = not self.isNonAtomic(L)
+        self.resetStructureCache()
         if L in self.latentDict:
             
             if children==self.latentDict[L]["children"] and subcovers==self.latentDict[L]["subcovers"] \
                 and fake_children==self.latentDict[L]["fake_children"]:
                 return False
             else:
+                # index under the key object, which may differ from L
+                key = next(K for K in self.latentDict if K == L)
+                self.indexChildren(key, set(children) - self.latentDict[L]["children"])
                 self.latentDict[L]["children"].update(children)
                 self.latentDict[L]["subcovers"].update(subcovers)
                 self.latentDict[L]["fake_children"].update(fake_children)
@@ -931,6 +1127,7 @@ class LatentGroups:
                 'fake_children': fake_children,
                 "refined": False,
             }
+            self.indexChildren(L, children)
             return True
 
         # If L is a rediscovered non-atomic, we might need to override edge(s)
@@ -1304,6 +1501,8 @@ class LatentGroups:
                     Gp.addOrUpdateCover(newCover, v["children"])
                     Gp.latentDict.pop(cover)
 
+        Gp.resetStructureCache()
+        Gp.rebuildParentIndex()
         return Gp
 
     def toNetworkX(self):
@@ -1359,6 +1558,8 @@ def pruneGraph(G: LatentGroups, Vs: set[Cover]):
                     Gp.latentDict[P]["children"] -= set([node])
 
     Gp.X = Gp.X.intersection(Vs)
+    Gp.resetStructureCache()
+    Gp.rebuildParentIndex()
     Gp.updateActiveSet()
     return Gp
 
@@ -5,6 +5,9 @@ from communities.algorithms import bron_kerbosch
 import numpy as np
 import copy
 import os
+import time
+import json
+import pickle
 from StructureLearning.RLCD.LatentGroups import LatentGroups, getLfromLatentGroups
 import StructureLearning.RLCD.misc as M
 from StructureLearning.RLCD.misc import Independences, Edges, powerset
@@ -13,13 +16,38 @@ from itertools import combinations
 from utils.GraphDrawer import DotGraph
 from joblib import delayed, Parallel
 from StructureLearning.RLCD.PC_CovRank import pc_true_cov_rank
+from StructureLearning.RLCD.SearchPool import SearchPool
+from StructureLearning.RLCD.RankMemo import RankMemo
 
 def RLCD(
     sample,
     xvars: list,
     df: pd.DataFrame = None,
     input_parameters: dict = None,
+    return_truncated: bool = False,
 ):
+    """
+    With input_parameters['time_budget'] (seconds) set, the search stops once
+    the budget is used up, checked between k rounds, unfolding branches and
+    partitions, and the structure confirmed so far is returned. If
+    return_truncated, a fifth value tells whether that happened.
+
+    With input_parameters['checkpoint_path'] set, the search state is written
+    there after every confirmed cluster and every k increment; resumeRLCD
+    continues the run from it.
+
+    input_parameters['candidate_order'] ('density' or 'screen') tests the
+    likeliest clusters of a round first, see orderCandidates; with
+    input_parameters['first_deficient'] each search task then stops at its
+    first cluster instead of testing all candidates.
+
+    With input_parameters['telemetry_path'] set, the counters of every k round
+    and unfolding branch are appended there as JSON lines, see
+    findClusters_at_k_mp.
+
+    input_parameters['max_unfoldings'] caps the number of unfolding branches
+    searched per k round.
+    """
 
     parameters = {
         "xvars": xvars,
@@ -35,12 +63,30 @@ def RLCD(
         "stage1_partition_thres": 3,
         "ranktest_method": None,
         "citest_method": None,
+        "n_jobs": -1,
+        "concurrent_partitions": True,
+        "time_budget": None,
+        "checkpoint_path": None,
+        "candidate_order": None,
+        "first_deficient": False,
+        "telemetry_path": None,
+        "max_unfoldings": None,
     }
 
     parameters.update(input_parameters)
     parameters['sample'] = sample
+    parameters['deadline'] = None if parameters['time_budget'] is None else time.time() + parameters['time_budget']
+    truncated = False
+
+    # resuming from a checkpoint: stage 1 and the finished partitions are
+    # taken from it rather than recomputed
+    resume_state = parameters.pop('resume_state', None)
 
-    if parameters['stages']>=1:
+    if resume_state is not None:
+        partition = resume_state['partition']
+        Adj_stage1 = resume_state['Adj_stage1']
+
+    elif parameters['stages']>=1:
         if not parameters['sample']:
             if parameters['stage1_method']=='all':
                 Adj_stage1 = np.ones((len(xvars),len(xvars)))
@@ -124,62 +170,103 @@ def RLCD(
 
     if parameters['stages']>=2:
 
-        for current_xvars in partition:
-
-            current_xvars_idx = [xvars.index(x) for x in current_xvars]
-
-            def get_neighbour_set(all_xvars, current_xvars, Adj):
-                nb_set = set()
-
-                for xvar1 in current_xvars:
-                    xvar1_idx = all_xvars.index(xvar1)
-
-                    for xvar2 in all_xvars:
-                        if xvar2 not in current_xvars:
-                            xvar2_idx = all_xvars.index(xvar2)
-
-                            if Adj[xvar1_idx, xvar2_idx]!=0: #adjacent
-                                nb_set.add(xvar2)
-
-                return nb_set
-            
-            neighbour_set = get_neighbour_set(xvars, current_xvars, Adj)
-
-            #local_Adj = Adj[current_xvars_idx].T[current_xvars_idx].T
-            local_Adj = Adj[np.ix_(current_xvars_idx, current_xvars_idx)]
-
-            current_G = LatentGroups(X=current_xvars, Xns=current_xvars, all_nb_set=neighbour_set, nb_set_dict={x_var:set() for x_var in current_xvars}, \
-                                     local_Adj=local_Adj)
-            
-            current_G = rlcd_find_latent(current_G, parameters)
-            current_output_Adj = getLfromLatentGroups(current_G, current_xvars)
-            current_output_Adj = getReducedAdj(current_output_Adj, [i for i in range(len(current_xvars))])
-
-            num_new_latent = current_output_Adj.shape[0] - len(current_xvars)
-
-            if num_new_latent>0:
-
-                # pad Adj by num_new_latent
-                temp = np.zeros((Adj.shape[0]+num_new_latent, Adj.shape[0]+num_new_latent))
-                temp[:Adj.shape[0],:Adj.shape[0]] = Adj
-                Adj = temp
-
-                def copy_by_idx(A_, B, indexes1_in_A, indexes2_in_A):
-                    A=A_.copy()
-                    assert(len(indexes1_in_A)==B.shape[0])
-                    assert(len(indexes2_in_A)==B.shape[1])
-                    for idx1_B, idx1_A in enumerate(indexes1_in_A):
-                        for idx2_B, idx2_A in enumerate(indexes2_in_A):
-                            A[idx1_A,idx2_A] = B[idx1_B,idx2_B]
-                    return A
-
-                # update x*x
-                Adj = copy_by_idx(Adj, current_output_Adj[:len(current_xvars), :len(current_xvars)], current_xvars_idx, current_xvars_idx)
-                # update x*l, l*x, and l*l
-                current_lvars_idx = [x for x in range(Adj.shape[0]-num_new_latent, Adj.shape[0])]
-                Adj = copy_by_idx(Adj, current_output_Adj[:len(current_xvars), len(current_xvars):], current_xvars_idx, current_lvars_idx)
-                Adj = copy_by_idx(Adj, current_output_Adj[len(current_xvars):, :len(current_xvars)], current_lvars_idx, current_xvars_idx)
-                Adj = copy_by_idx(Adj, current_output_Adj[len(current_xvars):, len(current_xvars):], current_lvars_idx, current_lvars_idx)
+        ranktest_method = parameters['ranktest_method']
+
+        # rank test outcomes are remembered across rounds and unfoldings
+        parameters['rank_memo'] = RankMemo(ranktest_method)
+        parameters['search_stats'] = {}
+
+        if resume_state is not None:
+            restoreRankCaches(parameters, resume_state)
+
+        # one worker pool for all rounds of all partitions, closed (and its
+        # shared files removed) however stage 2 ends
+        with SearchPool(parameters['n_jobs']) as search_pool:
+            parameters['search_pool'] = search_pool
+
+            # partitions sharing no variable are independent: each wave is run
+            # concurrently. Later waves read their neighbours from working_Adj,
+            # which has the earlier waves merged in; the result is merged into Adj
+            # in partition order at the end, so the latents are numbered as in a
+            # sequential run.
+            working_Adj = Adj
+            output_dict = {}
+            if resume_state is not None:
+                output_dict = resume_state['outputs']
+
+            if parameters['checkpoint_path'] is not None:
+                parameters['checkpoint_context'] = {'partition': partition, 'Adj_stage1': Adj_stage1, 'outputs': output_dict}
+
+            for wave in getPartitionWaves(partition):
+
+                if timeUp(parameters):
+                    LOGGER.info(f"Time budget reached, skipping the remaining partitions")
+                    truncated = True
+                    break
+
+                # partitions finished before a checkpoint only need merging
+                for i in wave:
+                    if i in output_dict:
+                        working_Adj = mergePartitionAdj(working_Adj, [xvars.index(x) for x in partition[i]], output_dict[i])
+                wave = [i for i in wave if i not in output_dict]
+
+                jobs = []
+                for i in wave:
+                    current_xvars = partition[i]
+                    current_xvars_idx = [xvars.index(x) for x in current_xvars]
+                    neighbour_set = getNeighbourSet(xvars, current_xvars, working_Adj)
+                    local_Adj = working_Adj[np.ix_(current_xvars_idx, current_xvars_idx)]
+
+                    if hasattr(ranktest_method, 'prefetch_columns'):
+                        ranktest_method.prefetch_columns(current_xvars_idx + [xvars.index(x) for x in neighbour_set])
+                    jobs.append((current_xvars, neighbour_set, local_Adj))
+
+                # with checkpoints, partitions run one at a time so that one
+                # search state describes the whole run
+                if len(jobs) <= 1 or not parameters['concurrent_partitions'] or parameters['checkpoint_path'] is not None:
+                    output_list = []
+                    for i, (current_xvars, neighbour_set, local_Adj) in zip(wave, jobs):
+                        resume = None
+                        if resume_state is not None and resume_state['partition_index'] == i:
+                            resume = (resume_state['G'], resume_state['k'], resume_state['unfold_index'])
+                        if parameters['checkpoint_path'] is not None:
+                            parameters['checkpoint_context']['partition_index'] = i
+                        parameters['search_pool'].share(parameters)
+                        current_output = findLatentInPartition(current_xvars, neighbour_set, local_Adj, parameters, resume)
+                        output_list.append(current_output)
+                        output_dict[i] = current_output[0]
+                else:
+                    # one partition per worker, each searched sequentially inside
+                    partition_parameters = {key: value for key, value in parameters.items() if key not in ('search_pool', 'search_stats')}
+                    partition_parameters['n_jobs'] = 1
+                    worker_output_list = Parallel(n_jobs=parameters['n_jobs'], backend='loky')(
+                        delayed(findLatentInPartitionWorker)(current_xvars, neighbour_set, local_Adj, partition_parameters)
+                        for current_xvars, neighbour_set, local_Adj in jobs
+                    )
+
+                    # the rank outcomes and counters of the workers, for the
+                    # later waves and the totals of the run
+                    output_list = []
+                    for current_output, new_entries, search_stats in worker_output_list:
+                        parameters['rank_memo'].update(new_entries)
+                        mergeStats(parameters['search_stats'], search_stats)
+                        output_list.append(current_output)
+
+                for i, (current_output_Adj, current_truncated, telemetry) in zip(wave, output_list):
+                    truncated = truncated or current_truncated
+                    if telemetry is not None:
+                        writeTelemetry(parameters['telemetry_path'], i, telemetry)
+                    output_dict[i] = current_output_Adj
+                    working_Adj = mergePartitionAdj(working_Adj, [xvars.index(x) for x in partition[i]], current_output_Adj)
+
+        for i, current_xvars in enumerate(partition):
+            if i in output_dict:
+                Adj = mergePartitionAdj(Adj, [xvars.index(x) for x in current_xvars], output_dict[i])
+
+        parameters.pop('search_pool')
+        parameters.pop('checkpoint_context', None)
+        search_stats = parameters['search_stats']
+        LOGGER.info(f"rank memo: {search_stats.get('memo_hits', 0)} hits, {search_stats.get('memo_misses', 0)} misses")
 
     # ending
     all_vars = [x for x in xvars]
@@ -204,6 +291,8 @@ def RLCD(
     result_combined_dotgraph = AdjToGraph(Adj_combined, all_vars) 
     result_stage1_dotgraph = AdjToGraph(Adj_stage1, xvars) 
     
+    if return_truncated:
+        return result_combined_dotgraph, result_stage1_dotgraph, Adj_combined, all_vars, truncated
     return result_combined_dotgraph, result_stage1_dotgraph, Adj_combined, all_vars
 
 
@@ -243,6 +332,108 @@ def getReducedAdj(Adj, cid_ls):
 
 
 
+def getPartitionWaves(partition):
+    """
+    Group the partitions into waves that can be searched concurrently. A
+    partition sharing a variable with an earlier one goes in a later wave
+    than it, since the merge of the earlier one changes the adjacencies its
+    neighbour set is read from.
+    """
+    wave_of = []
+    for i, current_xvars in enumerate(partition):
+        wave = 0
+        for j in range(i):
+            if len(set(current_xvars) & set(partition[j])) > 0:
+                wave = max(wave, wave_of[j] + 1)
+        wave_of.append(wave)
+
+    waves = [[] for _ in range(max(wave_of, default=-1) + 1)]
+    for i, wave in enumerate(wave_of):
+        waves[wave].append(i)
+    return waves
+
+def getNeighbourSet(all_xvars, current_xvars, Adj):
+    nb_set = set()
+
+    for xvar1 in current_xvars:
+        xvar1_idx = all_xvars.index(xvar1)
+
+        for xvar2 in all_xvars:
+            if xvar2 not in current_xvars:
+                xvar2_idx = all_xvars.index(xvar2)
+
+                if Adj[xvar1_idx, xvar2_idx]!=0: #adjacent
+                    nb_set.add(xvar2)
+
+    return nb_set
+
+def findLatentInPartition(current_xvars, neighbour_set, local_Adj, parameters, resume=None):
+    """
+    Stage 2 on one partition; returns its adjacency over current_xvars
+    followed by the new latents, whether the time budget cut it short and the
+    telemetry records of its rounds (None without telemetry_path).
+    resume = (G, k, unfold_index) continues a search from a checkpoint.
+    """
+    if resume is None:
+        current_G = LatentGroups(X=current_xvars, Xns=current_xvars, all_nb_set=neighbour_set, nb_set_dict={x_var:set() for x_var in current_xvars}, \
+                                 local_Adj=local_Adj)
+        k, unfold_index = 1, 0
+    else:
+        current_G, k, unfold_index = resume
+
+    parameters['truncated'] = False
+    parameters['telemetry'] = [] if parameters.get('telemetry_path') is not None else None
+    current_G = rlcd_find_latent(current_G, parameters, k, unfold_index)
+    current_output_Adj = getLfromLatentGroups(current_G, current_xvars)
+    current_output_Adj = getReducedAdj(current_output_Adj, [i for i in range(len(current_xvars))])
+    return current_output_Adj, parameters['truncated'], parameters['telemetry']
+
+def findLatentInPartitionWorker(current_xvars, neighbour_set, local_Adj, parameters):
+    """
+    findLatentInPartition in a worker of the concurrent partition search.
+    Also returns the rank memo entries and the search stats of the partition,
+    to be merged into those of the parent.
+    """
+    parameters['search_stats'] = {}
+    rank_memo = parameters['rank_memo']
+    rank_memo.popNewEntries()
+
+    output = findLatentInPartition(current_xvars, neighbour_set, local_Adj, parameters)
+    return output, rank_memo.popNewEntries(), parameters['search_stats']
+
+def mergePartitionAdj(Adj, current_xvars_idx, current_output_Adj):
+    """
+    Pad Adj with the new latents of one partition and copy its result in.
+    """
+    num_new_latent = current_output_Adj.shape[0] - len(current_xvars_idx)
+
+    if num_new_latent>0:
+
+        # pad Adj by num_new_latent
+        temp = np.zeros((Adj.shape[0]+num_new_latent, Adj.shape[0]+num_new_latent))
+        temp[:Adj.shape[0],:Adj.shape[0]] = Adj
+        Adj = temp
+
+        def copy_by_idx(A_, B, indexes1_in_A, indexes2_in_A):
+            A=A_.copy()
+            assert(len(indexes1_in_A)==B.shape[0])
+            assert(len(indexes2_in_A)==B.shape[1])
+            for idx1_B, idx1_A in enumerate(indexes1_in_A):
+                for idx2_B, idx2_A in enumerate(indexes2_in_A):
+                    A[idx1_A,idx2_A] = B[idx1_B,idx2_B]
+            return A
+
+        n = len(current_xvars_idx)
+        # update x*x
+        Adj = copy_by_idx(Adj, current_output_Adj[:n, :n], current_xvars_idx, current_xvars_idx)
+        # update x*l, l*x, and l*l
+        current_lvars_idx = [x for x in range(Adj.shape[0]-num_new_latent, Adj.shape[0])]
+        Adj = copy_by_idx(Adj, current_output_Adj[:n, n:], current_xvars_idx, current_lvars_idx)
+        Adj = copy_by_idx(Adj, current_output_Adj[n:, :n], current_lvars_idx, current_xvars_idx)
+        Adj = copy_by_idx(Adj, current_output_Adj[n:, n:], current_lvars_idx, current_lvars_idx)
+
+    return Adj
+
 def getPartition(xvars, Adj, clique_size_thres, direct_mode=False):
 
     def checkRelationBetweenCliques(clique1, clique2):
@@ -336,9 +527,78 @@ def AdjToGraph(Adj, varnames_for_Adj):
     return dotGraph
 
 
-def rlcd_find_latent(G:LatentGroups, parameters):
+def saveCheckpoint(parameters, G, k, unfold_index):
+    """
+    Write the search state to parameters['checkpoint_path']: stage 1, the
+    finished partitions, the LatentGroups of the current one with its k and
+    unfolding branch, and the rank caches. Written to a temporary file and
+    renamed, so a preempted run always leaves a complete checkpoint.
+    """
+    context = parameters['checkpoint_context']
+    ranktest_method = parameters['ranktest_method']
+
+    state = {
+        'partition': context['partition'],
+        'Adj_stage1': context['Adj_stage1'],
+        'outputs': dict(context['outputs']),
+        'partition_index': context['partition_index'],
+        'G': G,
+        'k': k,
+        'unfold_index': unfold_index,
+        'rank_memo': parameters['rank_memo'].table if parameters.get('rank_memo') is not None else {},
+        'cancorr_cache': dict(ranktest_method.cca_cache_dict.items()) if hasattr(ranktest_method, 'cca_cache_dict') else {},
+    }
+
+    path = parameters['checkpoint_path']
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+    LOGGER.info(f"Checkpoint written to {path} (partition {context['partition_index']}, k={k})")
+
+def restoreRankCaches(parameters, resume_state):
+    parameters['rank_memo'].update(resume_state['rank_memo'])
+    ranktest_method = parameters['ranktest_method']
+    if hasattr(ranktest_method, 'cca_cache_dict'):
+        for key, cancorr in resume_state['cancorr_cache'].items():
+            ranktest_method.cca_cache_dict[key] = cancorr
+
+def resumeRLCD(
+    checkpoint_path,
+    sample,
+    xvars: list,
+    df: pd.DataFrame = None,
+    input_parameters: dict = None,
+    return_truncated: bool = False,
+):
+    """
+    Continue an RLCD run from a checkpoint written with
+    input_parameters['checkpoint_path']. input_parameters must hold the same
+    rank test (and data) as the original run; checkpoints keep being written
+    to checkpoint_path unless input_parameters sets another path.
+    """
+    with open(checkpoint_path, 'rb') as f:
+        resume_state = pickle.load(f)
+
+    input_parameters = dict(input_parameters)
+    input_parameters.setdefault('checkpoint_path', checkpoint_path)
+    input_parameters['resume_state'] = resume_state
+    return RLCD(sample, xvars, df, input_parameters, return_truncated)
+
+def writeTelemetry(path, partition_index, records):
+    """
+    Append the round records of one partition to path, one JSON object per
+    line.
+    """
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps({'partition': partition_index, **record}) + '\n')
+
+def timeUp(parameters):
+    return parameters.get('deadline') is not None and time.time() > parameters['deadline']
+
+def rlcd_find_latent(G:LatentGroups, parameters, k=1, unfold_index=0):
     if parameters['stages'] >= 2:
-        G, _ = findClusters(G, parameters)
+        G, _ = findClusters(G, parameters, k, unfold_index)
 
     #if parameters['stages'] >= 3:
     #    G = refineClusters(G)
@@ -346,18 +606,56 @@ def rlcd_find_latent(G:LatentGroups, parameters):
     return G
 
 
+def getActiveLatents(G):
+    Ls = set([V for V in G.activeSet if V.is_leaf==False])
+    Ls_ordered = list(Ls)
+    Ls_ordered.sort(key=lambda x: getOrderedVarsString(x))
+    return Ls_ordered
+
 def generateLatentPowersetFromActiveSet(G):
     """
     Generate an iterator over powerset of active latents,
     Including the combination where all latents are included.
+    Lazy, the full set first and the empty set last.
     """
+    return M.reversedPowerset(getActiveLatents(G))
 
-    Ls = set([V for V in G.activeSet if V.is_leaf==False])
-    Ls_ordered = list(Ls)
-    Ls_ordered.sort(key=lambda x: getOrderedVarsString(x))
-    Lsubsets = reversed(list(M.powerset(Ls_ordered)))
+def unfoldActiveSets(G: LatentGroups, Ls, activeSet, activeNonSinkSet, unfoldings):
+    """
+    The active set and non-sink set of the search with the latents Ls
+    unfolded: each L with more than one child or measured subset is replaced
+    by them. The children and measured subsets of each L are looked up once
+    per round in unfoldings.
+    """
+    Vprime = activeSet.copy()
+    Tprime = activeNonSinkSet.copy()
+
+    for L in Ls:
+        # L is a Cover
+        if L not in unfoldings:
+            #children = G.findChildren(L, rigorous=False) # 
+            unfoldings[L] = (G.findChildren(L, rigorous=True), G.findMeassuredSubset(L))
+        children, meassured_subset_L = unfoldings[L]
+        for cover in meassured_subset_L:
+            Tprime |= cover.vars
+
+        # If children of L is just one or zero variable, do not replace
+        if len(children) + len(meassured_subset_L) > 1:
+        #if len(children)>= 1:
+            Vprime.discard(L)
+            Vprime |= children
+            Vprime |= meassured_subset_L
 
-    return [x for x in Lsubsets]
+    children = G.findChildrenOfAllSubSets(Ls) # 
+    Vprime |= children
+
+    # non-leaf measures of the previous search stay non-sinks
+    for cover in G.activeSet:
+        if len(cover.vars)==1 and cover.takeOne() in G.X_dict:
+            if G.X_dict[cover.takeOne()].is_leaf!=True:
+                Tprime |= cover.vars
+
+    return Vprime, Tprime
 
 def getVarNames(As):
     measuredVars = []
@@ -368,20 +666,14 @@ def getVarNames(As):
             measuredVars.append(temp)
     return measuredVars
     
-def structuralRankTest(xvars, ranktest_method, alpha_dict, G: LatentGroups, As, Bs, k, nonLeafs):
+def getRankTestCols(xvars, G: LatentGroups, As, Bs, nonLeafs):
     """
-    Test if As forms a cluster by seeing if rank(subcov[A,B]) <= k.
-
-    Returns tuple of whether rank is deficient and lowest rank tested.
+    Column indices (pcols, qcols) of the measures under As and Bs, with the
+    nonLeafs added to both sides.
     """
 
-    Ameasures = G.pickAllMeasures(As)
-    Ameasures = getVarNames(Ameasures)
-    Bmeasures = G.pickAllMeasures(Bs)
-    Bmeasures = getVarNames(Bmeasures)
-
-    Ameasures += nonLeafs
-    Bmeasures += nonLeafs
+    Ameasures = G.bitsToNames(G.pickAllMeasureBits(As) | G.varBits(nonLeafs))
+    Bmeasures = G.bitsToNames(G.pickAllMeasureBits(Bs) | G.varBits(nonLeafs))
 
     Ameasures = list(set(Ameasures))
     Bmeasures = list(set(Bmeasures))
@@ -389,19 +681,41 @@ def structuralRankTest(xvars, ranktest_method, alpha_dict, G: LatentGroups, As,
     pcols = [xvars.index(a) for a in Ameasures]
     qcols = [xvars.index(b) for b in Bmeasures]
 
-    fail_to_reject = ranktest_method.test(pcols, qcols, k, alpha_dict[k])
+    return pcols, qcols
+
+def generateCandidateSubsets(activeSet, gap, prune=None):
+    """
+    Lazily generate the candidate As for one call of
+    findClusters_at_k_by_nonsinks: the minimal subsets of activeSet with
+    cardinality > gap, plus, for each Cover v of cardinality > gap, v together
+    with the minimal nonempty subsets of the other Covers. Yielded in reverse
+    order of generation, last Cover's extra subsets first.
+    """
+    extra = [v for v in activeSet if len(v)>=gap+1 and gap!=0] # more than or eq
+    for v in reversed(extra):
+        tempset = activeSet.copy()
+        tempset.remove(v)
+        for x in M.generateSubsetMinimal(tempset, 0, prune=prune, reverse=True):
+            x.add(v)
+            yield x
+
+    yield from M.generateSubsetMinimal(activeSet, gap, prune=prune, reverse=True)
+
+def structuralRankTest(xvars, ranktest_method, alpha_dict, G: LatentGroups, As, Bs, k, nonLeafs):
+    """
+    Test if As forms a cluster by seeing if rank(subcov[A,B]) <= k.
+
+    Returns tuple of whether rank is deficient and lowest rank tested.
+    """
+
+    pcols, qcols = getRankTestCols(xvars, G, As, Bs, nonLeafs)
 
-    if fail_to_reject==False:
-        return (fail_to_reject, None)
+    min_rank = ranktest_method.min_rank(pcols, qcols, k, alpha_dict)
+
+    if min_rank is None:
+        return (False, None)
     else:
-        min_rank = k
-        for h0_k in range(k-1, -1, -1):
-            fail_to_reject_h0_k = ranktest_method.test(pcols, qcols, h0_k, alpha_dict[h0_k])
-            if fail_to_reject_h0_k:
-                min_rank = h0_k
-            else:
-                break
-        return fail_to_reject, min_rank
+        return (True, min_rank)
 
 def findClusters_at_k_by_nonsinks(G: LatentGroups, k, nonsinks, parameters):
     """
@@ -410,6 +724,12 @@ def findClusters_at_k_by_nonsinks(G: LatentGroups, k, nonsinks, parameters):
     terminate = False  # Whether we ran out of variables to test
     found = False  # Whether we found any clusters
     res_for_add = []
+    stats = {'candidates': 0, 'pruned_MeassuredHasNonSinks': 0, 'rank_tests': 0, 'screen_rejections': 0, 'memo_hits': 0, 'memo_misses': 0, \
+             'v_structure_tests': 0, 'v_structure_screen_rejections': 0, 'v_structure_memo_hits': 0, 'v_structure_memo_misses': 0, \
+             'time_enumerate': 0, 'time_rank_tests': 0, 'time_v_structure': 0}
+    for name in CANDIDATE_FILTERS:
+        stats['filtered_' + name] = 0
+    start = time.time()
 
     num_nonsinks = len(nonsinks)
 
@@ -426,34 +746,42 @@ def findClusters_at_k_by_nonsinks(G: LatentGroups, k, nonsinks, parameters):
     # i.e.             k > n/2 - 1
     if k-num_nonsinks > setLength(current_activeSet) / 2 - 1:
         terminate = True
-        return (found, terminate, res_for_add)
+        stats['time_enumerate'] = time.time() - start
+        return (found, terminate, res_for_add, stats)
     
     if k!=len(nonsinks): # could induce latent then do not consider those neighbours in active set
         for temp in G.all_nb_set:
             if temp in G.X_dict and G.X_dict[temp] in current_activeSet:
                 current_activeSet.discard(G.X_dict[temp])
 
-    allSubsets = [x for x in M.generateSubsetMinimal(current_activeSet, k-num_nonsinks)]
+    # As whose measures include a nonsink are skipped below, and so are all
+    # their supersets: drop those branches during the enumeration already
+    prune = None
+    if len(nonsinks) > 0:
+        def prune(As):
+            if G.MeassuredHasNonSinks(As, nonsinks):
+                stats['pruned_MeassuredHasNonSinks'] += 1
+                return True
+            return False
 
-    
-    for v in current_activeSet:
-        if len(v)>=k-num_nonsinks+1 and k-num_nonsinks!=0: # more than or eq 
-            tempset = current_activeSet.copy()
-            tempset.remove(v)
-            additionalls = [x for x in M.generateSubsetMinimal(tempset, 0)]
-            for x in additionalls:
-                x.add(v)
-            allSubsets=allSubsets+additionalls
-
-
-    # If no subsets can be generated, terminate
-    if allSubsets == [set()]:
-        terminate = True
-        return (found, terminate, res_for_add)
+    # collect the candidates passing all filters first, so that their rank
+    # tests can be issued as one batch
+    candidates = []
 
-    #for As in allSubsets:
-    for As in reversed(allSubsets):
+    for As in generateCandidateSubsets(current_activeSet, k-num_nonsinks, prune):
         #As = set(As)  # test set
+        stats['candidates'] += 1
+
+        if {x.__str__() for x in As}==set(['X3','X5','X7']):
+            print("!!!!")
+
+        observed_vars_in_As = {x.__str__() for x in As if x.is_observed}
+        observed_vars_in_As_and_nonsinks = observed_vars_in_As.union(set(nonsinks))
+
+        # cheapest filter first, it does not depend on Bs
+        if not G.isLocallyConnected(observed_vars_in_As_and_nonsinks):
+            stats['filtered_isLocallyConnected'] += 1
+            continue
 
         effective_ChildrenOfNonAtomicsSet = current_ChildrenOfNonAtomicsSet.copy()
         temp_set = As | {G.X_dict[t] for t in nonsinks}
@@ -467,37 +795,9 @@ def findClusters_at_k_by_nonsinks(G: LatentGroups, k, nonsinks, parameters):
         #BBs = setDifference(current_activeSet, As)  # control set
         ##################    for debuging
         ##################    
-    
-        if {x.__str__() for x in As}==set(['X3','X5','X7']):
-            print("!!!!")
-
-        observed_vars_in_As = {x.__str__() for x in As if x.is_observed}
-        observed_vars_in_As_and_nonsinks = observed_vars_in_As.union(set(nonsinks))
-        observed_vars_in_As_and_nonsinks = list(observed_vars_in_As_and_nonsinks)
-        observed_vars_in_As_and_nonsinks_idx_in_local_adj = [G.x_list_for_local_Adj.index(x) for x in observed_vars_in_As_and_nonsinks]
-
-        temp_local_adj = G.local_Adj[observed_vars_in_As_and_nonsinks_idx_in_local_adj,:][:,observed_vars_in_As_and_nonsinks_idx_in_local_adj]
-
-        def check_dsu(adj): 
-            num_var = len(adj)
-            dsu = DSU(num_var)
-            for i in range(num_var):
-                for j in range(num_var):
-                    if i!=j and (adj[i,j]!=0 or adj[j,i]!=0):
-                        dsu.union(i, j)
-            fa_set = set()
-            for i in range(num_var):
-                fa_set.add(dsu.find(i))
-
-            if len(fa_set)==1:
-                return True
-            else:
-                return False
-
-        if not check_dsu(temp_local_adj):
-            continue
 
         if setLength(Bs)<=k-len(nonsinks):
+            stats['filtered_controlSetSize'] += 1
             continue
         #if len(As) > setLength(Bs):
         #    continue
@@ -505,36 +805,64 @@ def findClusters_at_k_by_nonsinks(G: LatentGroups, k, nonsinks, parameters):
         # As must not contain more than k elements from
         # any atomic Cover with cardinality <= k-1
         if G.containsCluster(As, nonsinks): # toask
+            stats['filtered_containsCluster'] += 1
             continue
 
         #if G.containsonlyaCluster(Bs, nonsinks): # toask
         #    continue
 
         if G.overlapPaCh(As):
+            stats['filtered_overlapPaCh'] += 1
             continue
 
         if G.MeassuredHasNonSinks(As, nonsinks):
+            stats['filtered_MeassuredHasNonSinks'] += 1
             continue
 
         if G.checkNonSinksAreAsChildren(As, nonsinks):
+            stats['filtered_checkNonSinksAreAsChildren'] += 1
             continue
 
         # Bs parentCardinality cannot be < k+1, since otherwise
         # we get rank <= k regardless of what As is
         if G.parentCardinality(Bs) <= k - num_nonsinks: # dxs seems important to LLHCase2
+            stats['filtered_parentCardinality'] += 1
             continue
             #if len(unfolded)==1 and Bs.issubset(G.findChildren(unfolded[0])):
             #    print("allow parentCardinality(Bs) <= k - num_nonsinks")
             #else:
             #    continue
 
-        fail_to_reject, rk = structuralRankTest(parameters['xvars'], parameters['ranktest_method'], parameters['alpha_dict'], G, As, Bs, k, list(nonsinks))
-        
+        candidates.append((As, Bs))
+
+    stats['time_enumerate'] = time.time() - start
+    start = time.time()
+
+    rank_tester = getRankTester(parameters)
+    counters_before = getRankTestCounters(parameters)
+
+    pairs = [getRankTestCols(parameters['xvars'], G, As, Bs, list(nonsinks)) for As, Bs in candidates]
+
+    if parameters.get('candidate_order') is not None:
+        candidates, pairs = orderCandidates(G, k, candidates, pairs, nonsinks, parameters)
+
+    first_deficient = parameters.get('first_deficient', False)
+    if first_deficient:
+        # one test at a time, up to the first cluster
+        min_ranks = (rank_tester.min_rank(pcols, qcols, k, parameters['alpha_dict']) for pcols, qcols in pairs)
+    else:
+        min_ranks = rank_tester.min_rank_batch(pairs, k, parameters['alpha_dict'])
+
+    for (As, Bs), rk in zip(candidates, min_ranks):
+        stats['rank_tests'] += 1
+        fail_to_reject = rk is not None
 
         if fail_to_reject:
             LOGGER.info(f"   {As} is rank deficient! given {nonsinks}, Bs:{Bs}")
 
             v_structure_found = False
+            v_start = time.time()
+            v_counters_before = getRankTestCounters(parameters)
 
             if parameters['check_v']:
                 # check v structure
@@ -543,22 +871,115 @@ def findClusters_at_k_by_nonsinks(G: LatentGroups, k, nonsinks, parameters):
                     for subAs in M.generateSubsetMinimal(As, num_subAs-1):
                         #test_subAs, rk_subAs = self.structuralRankTest(G, subAs, Bs - current_ChildrenOfNonAtomicsSet, num_nonsinks+num_subAs-1, list(nonsinks))
                         test_subAs, rk_subAs = \
-                            structuralRankTest(parameters['xvars'], parameters['ranktest_method'], parameters['alpha_dict'], G, subAs, Bs, num_nonsinks+num_subAs-1, list(nonsinks))
+                            structuralRankTest(parameters['xvars'], rank_tester, parameters['alpha_dict'], G, subAs, Bs, num_nonsinks+num_subAs-1, list(nonsinks))
+                        stats['v_structure_tests'] += 1
                         if test_subAs:
                             LOGGER.info(f"   {As} has v structure! subAs:{subAs} given {nonsinks}, Bs:{Bs}")
                             v_structure_found = True
+
+            # counted apart from the rank tests of the candidates
+            stats['time_v_structure'] += time.time() - v_start
+            for key, value in getRankTestCounters(parameters, v_counters_before).items():
+                stats['v_structure_' + key] += value
      
             if v_structure_found == False:
                 res_for_add.append((As, rk, nonsinks))
                 #G.addRankDefSet(As, rk, used_nonsinks=nonsinks)
                 found = True
 
-    return (found, terminate, res_for_add)
+                if first_deficient:
+                    break
+
+    stats['time_rank_tests'] = time.time() - start - stats['time_v_structure']
+    for key, value in getRankTestCounters(parameters, counters_before).items():
+        stats[key] = value - stats['v_structure_' + key]
+
+    return (found, terminate, res_for_add, stats)
+
+def orderCandidates(G: LatentGroups, k, candidates, pairs, nonsinks, parameters):
+    """
+    Sort the candidates (As, Bs) and their rank test columns by how likely As
+    is a cluster, likeliest first:
+    'density': density of the stage-1 adjacency among the measured As and
+        nonsinks, highest first.
+    'screen': the screening bound of the rank test on the statistic of
+        rank <= k, lowest first (falls back to 'density' for rank tests
+        without one).
+    The sort is stable, ties keep the enumeration order.
+    """
+    ranktest_method = parameters['ranktest_method']
+    order = parameters['candidate_order']
+
+    if order == 'screen' and hasattr(ranktest_method, 'screen_bound'):
+        scores = [ranktest_method.screen_bound(pcols, qcols, k) for pcols, qcols in pairs]
+    elif order in ('density', 'screen'):
+        scores = []
+        for As, _ in candidates:
+            xs = {x.__str__() for x in As if x.is_observed} | set(nonsinks)
+            scores.append(-G.localDensity(xs))
+    else:
+        raise NotImplementedError(f"candidate_order {order}")
+
+    index = sorted(range(len(candidates)), key=lambda i: scores[i])
+    return [candidates[i] for i in index], [pairs[i] for i in index]
+
+def getRankTestCounters(parameters, before=None):
+    """
+    The screen rejections of the rank test and the hits and misses of the
+    rank memo so far; with before, the increments since then.
+    """
+    rank_tester = getRankTester(parameters)
+    counters = {'screen_rejections': getattr(parameters['ranktest_method'], 'screen_counts', {}).get('screen_rejections', 0), \
+                'memo_hits': getattr(rank_tester, 'hits', 0), 'memo_misses': getattr(rank_tester, 'misses', 0)}
+    if before is not None:
+        counters = {key: value - before[key] for key, value in counters.items()}
+    return counters
+
+def getRankTester(parameters):
+    """
+    The rank test to use in the search: the cross-round memo when there is
+    one, otherwise the rank test itself.
+    """
+    if parameters.get('rank_memo') is not None:
+        return parameters['rank_memo']
+    return parameters['ranktest_method']
+
+# candidate filters of findClusters_at_k_by_nonsinks, in the order applied
+CANDIDATE_FILTERS = ['isLocallyConnected', 'controlSetSize', 'containsCluster', 'overlapPaCh', 'MeassuredHasNonSinks', \
+                     'checkNonSinksAreAsChildren', 'parentCardinality']
+
+def mergeStats(total, stats):
+    for key, value in stats.items():
+        total[key] = total.get(key, 0) + value
+    return total
+
+def logRoundStats(k, round_stats, parameters):
+    LOGGER.info(f"k={k}: {round_stats.get('rank_tests', 0)} candidate rank tests, {round_stats.get('screen_rejections', 0)} rejected by the screen, " \
+                f"rank memo {round_stats.get('memo_hits', 0)} hits / {round_stats.get('memo_misses', 0)} misses")
+    if parameters.get('search_stats') is not None:
+        mergeStats(parameters['search_stats'], round_stats)
+    if parameters.get('telemetry') is not None:
+        record = {'k': k}
+        record.update(parameters.get('telemetry_branch', {}))
+        record.update(round_stats)
+        lookups = record.get('memo_hits', 0) + record.get('memo_misses', 0)
+        record['rank_memo_hit_rate'] = record.get('memo_hits', 0) / lookups if lookups > 0 else None
+        parameters['telemetry'].append(record)
     
 
 def findClusters_at_k_mp(G: LatentGroups, k, parameters, n_jobs=-1):
     """
     Run one round of search for clusters of size k.
+
+    The counters of the round go to logRoundStats: those of
+    findClusters_at_k_by_nonsinks (candidates, filtered_<filter> per filter
+    of CANDIDATE_FILTERS, pruned_MeassuredHasNonSinks for the enumeration
+    branches cut by that filter, rank_tests with their memo_hits/misses and
+    screen_rejections, v_structure_tests with their own
+    v_structure_memo_hits/misses and v_structure_screen_rejections, and
+    time_enumerate/rank_tests/v_structure, summed over the tasks), plus the
+    wall times time_search and time_confirm of the two phases of the round.
+    Telemetry records add rank_memo_hit_rate, over the candidate tests.
     """
     LOGGER.info(f"Starting searchClusters k={k}...")
     global_terminate=True
@@ -576,19 +997,28 @@ def findClusters_at_k_mp(G: LatentGroups, k, parameters, n_jobs=-1):
         for nonsinks in nonsinks_ls:
             input_list.append(list(nonsinks).copy())
 
-    output_list = Parallel(n_jobs=n_jobs, backend='loky')(
-            delayed(findClusters_at_k_by_nonsinks)(G, k, nonsinks, parameters)
-            for nonsinks in input_list
-        )
+    start = time.time()
+    if parameters.get('search_pool') is not None:
+        output_list = parameters['search_pool'].run(G, k, input_list, parameters.get('rank_memo'))
+    else:
+        output_list = Parallel(n_jobs=n_jobs, backend='loky')(
+                delayed(findClusters_at_k_by_nonsinks)(G, k, nonsinks, parameters)
+                for nonsinks in input_list
+            )
             
+    round_stats = {}
     for output in output_list:
-        current_found_deficiency, current_terminate, res_for_add = output
+        current_found_deficiency, current_terminate, res_for_add, stats = output
         found_deficiency = found_deficiency or current_found_deficiency
         global_terminate = global_terminate and current_terminate
+        mergeStats(round_stats, stats)
 
         for i in range(len(res_for_add)):
             G.addRankDefSet(res_for_add[i][0], res_for_add[i][1], used_nonsinks=res_for_add[i][2])
 
+    round_stats['time_search'] = time.time() - start
+    start = time.time()
+
     if found_deficiency:
         G.determineClusters() # all the input deficient set are based on the same nonLeafs
         found = G.confirmClusters()
@@ -599,7 +1029,10 @@ def findClusters_at_k_mp(G: LatentGroups, k, parameters, n_jobs=-1):
             G.updateactiveNonSinkSet()
             M.display(G)
             #printGraph(G)
-            return G, (global_found, global_terminate)
+
+    round_stats['time_confirm'] = time.time() - start
+    round_stats['found'] = int(global_found)
+    logRoundStats(k, round_stats, parameters)
 
     return G, (global_found, global_terminate)
 
@@ -611,6 +1044,7 @@ def findClusters_at_k(G: LatentGroups, k, parameters):
     global_terminate=True
     global_found=False
     found_deficiency = False
+    round_stats = {}
 
     for num_nonsinks in range(k, -1, -1): # [k,k-1,...,0]
         
@@ -620,13 +1054,15 @@ def findClusters_at_k(G: LatentGroups, k, parameters):
 
         for nonsinks in nonsinks_ls:
             
-            current_found_deficiency, current_terminate, res_for_add = findClusters_at_k_by_nonsinks(G, k, list(nonsinks), parameters)
+            current_found_deficiency, current_terminate, res_for_add, stats = findClusters_at_k_by_nonsinks(G, k, list(nonsinks), parameters)
             found_deficiency = found_deficiency or current_found_deficiency
             global_terminate = global_terminate and current_terminate
+            mergeStats(round_stats, stats)
 
             for i in range(len(res_for_add)):
                 G.addRankDefSet(res_for_add[i][0], res_for_add[i][1], used_nonsinks=res_for_add[i][2])
         
+    logRoundStats(k, round_stats, parameters)
 
     if found_deficiency:
         G.determineClusters() # all the input deficient set are based on the same nonLeafs
@@ -644,68 +1080,77 @@ def findClusters_at_k(G: LatentGroups, k, parameters):
     return G, (global_found, global_terminate)
 
 
-def findClusters(G: LatentGroups, parameters):
+def findClusters(G: LatentGroups, parameters, k=1, unfold_index=0):
+    """
+    Search clusters of increasing size k, restarting from k=1 after each
+    found cluster. A search resumed from a checkpoint starts at its k and at
+    unfolding branch unfold_index.
+    """
 
     prevCovers = set(G.latentDict.keys())  # Record current latent Covers
 
-    k = 1
+    truncated = False
     while True:
+        # a checkpoint at the start of every round, i.e. after each confirmed
+        # cluster and each k increment
+        if parameters.get('checkpoint_context') is not None:
+            saveCheckpoint(parameters, G, k, unfold_index)
+
+        # anytime: stop between rounds once the time budget is used up, and
+        # finish the graph from the clusters confirmed so far
+        if timeUp(parameters):
+            LOGGER.info(f"Time budget reached before k={k}, finishing with the clusters found so far")
+            truncated = True
+            break
+
         LOGGER.info(f"{'-'*15} Test Cardinality now k={k} {'-'*15}")
         
         if parameters['unfold_covers']:
             LPowerSet = generateLatentPowersetFromActiveSet(G)
+            n_branches = 2 ** len(getActiveLatents(G))
         else:
             LPowerSet = [()]
+            n_branches = 1
         activeSetCopy = copy.deepcopy(G.activeSet)
         activeNonSinkSetCopy = copy.deepcopy(G.activeNonSinkSet)
 
+        # branches are built from the round's sets as they are reached; one
+        # whose active sets equal those of an earlier branch would search the
+        # same candidates again, and is skipped
+        unfoldings = {}
+        searched = set()
+        found = False
+
         # Select a combination of latents, and replace their place in
         # the activeSet with their children for the search
         for i, Ls in enumerate(LPowerSet):
 
-            if i==0:
-                all_unfolded=True
-            else:
-                all_unfolded=False
-
-            Vprime = copy.deepcopy(activeSetCopy)
-            Tprime = copy.deepcopy(activeNonSinkSetCopy)
-
-            for L in Ls:
-                # L is a Cover
-                #children = G.findChildren(L, rigorous=False) # 
-                children = G.findChildren(L, rigorous=True) # 
-                meassured_subset_L = G.findMeassuredSubset(L)
-                for cover in meassured_subset_L:
-                    Tprime |= cover.vars
-
-                # If children of L is just one or zero variable, do not replace
-                if len(children) + len(meassured_subset_L) > 1:
-                #if len(children)>= 1:
-                    Vprime = Vprime - set([L])
-                    Vprime |= children
-                    Vprime |= meassured_subset_L
-
-            children = G.findChildrenOfAllSubSets(Ls) # 
-            Vprime |= children
+            Vprime, Tprime = unfoldActiveSets(G, Ls, activeSetCopy, activeNonSinkSetCopy, unfoldings)
+            if not parameters['allow_nonleafx']:
+                Tprime = set()
+            branch = (frozenset(Vprime), frozenset(Tprime))
 
-            for cover in G.activeSet:
-                if len(cover.vars)==1 and cover.takeOne() in G.X_dict:
-                    if G.X_dict[cover.takeOne()].is_leaf!=True:
-                        Tprime |= cover.vars
+            if i < unfold_index or branch in searched:
+                # searched before the checkpoint, or already in this round
+                G.activeSet = Vprime
+                G.activeNonSinkSet = Tprime
+                searched.add(branch)
+                continue
 
-            
-            G.activeSet = Vprime
+            if parameters.get('max_unfoldings') is not None and len(searched) >= parameters['max_unfoldings']:
+                LOGGER.info(f"Searched {len(searched)} unfoldings at k={k}, skipping the rest")
+                break
 
-            if parameters['allow_nonleafx']:
-                G.activeNonSinkSet = Tprime
-            else:
-                G.activeNonSinkSet = set()
+            if i > 0 and timeUp(parameters):
+                LOGGER.info(f"Time budget reached before unfolding {Ls}, finishing with the clusters found so far")
+                truncated = True
+                break
+
+            searched.add(branch)
+            G.activeSet = Vprime
+            G.activeNonSinkSet = Tprime
 
-            LOGGER.info(f"Unfolding {Ls}")
-            LOGGER.info(f"G.activeSet {G.activeSet}")
-            LOGGER.info(f"G.activeNonSinkSet {G.activeNonSinkSet}")
-            G, (found, terminate) = findClusters_at_k_mp(G, k, parameters, n_jobs=-1)
+            G, (found, terminate) = findClusters_at_k_mp(G, k, parameters, n_jobs=parameters.get('n_jobs', -1))
             #G, (found, terminate) = findClusters_at_k(G, k, parameters)
 
             if found:
@@ -722,6 +1167,19 @@ def findClusters(G: LatentGroups, parameters):
                 k = 1
                 break
 
+            # nothing found in this branch: checkpoint before the next one,
+            # with the active sets of the round rather than of this branch
+            if parameters.get('checkpoint_context') is not None and i + 1 < n_branches:
+                branchActiveSet, branchNonSinkSet = G.activeSet, G.activeNonSinkSet
+                G.activeSet, G.activeNonSinkSet = activeSetCopy, activeNonSinkSetCopy
+                saveCheckpoint(parameters, G, k, i + 1)
+                G.activeSet, G.activeNonSinkSet = branchActiveSet, branchNonSinkSet
+
+        unfold_index = 0
+
+        if truncated:
+            break
+
         # CASE 3
         if not found:
             LOGGER.info("Nothing found!")
@@ -739,6 +1197,7 @@ def findClusters(G: LatentGroups, parameters):
     # 1
 
     newCovers = set(G.latentDict.keys()) - prevCovers
+    parameters['truncated'] = parameters.get('truncated', False) or truncated
     return G, newCovers
 
 
@@ -772,7 +1231,7 @@ def findClusters_finish(G: LatentGroups, parameters):
             for i in range(len(remain_observed_covers)):
                 to_add = set()
                 for j in range(len(remain_latent_covers)):
-                    fail_to_reject, rk = structuralRankTest(parameters['xvars'], parameters['ranktest_method'], parameters['alpha_dict'], G, \
+                    fail_to_reject, rk = structuralRankTest(parameters['xvars'], getRankTester(parameters), parameters['alpha_dict'], G, \
                                                             set([remain_observed_covers[i]]), set([remain_latent_covers[j]]), 0, [])
                     if not fail_to_reject:
                         to_add.add(remain_latent_covers[j])
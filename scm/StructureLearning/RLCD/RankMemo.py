@@ -0,0 +1,66 @@
+class RankMemo(object):
+    """
+    Memo of rank test outcomes for the whole cluster search, in front of the
+    rank test. Found clusters reset the search to k=1 and most candidate
+    subsets map to the same measured columns as in the earlier rounds, so
+    their outcome is looked up instead of tested again; only subsets touching
+    new latent covers reach the rank test.
+
+    Entries are keyed on the bitsets of the measured columns (pcols, qcols)
+    and kmax, and hold the min_rank result. Outcomes are symmetric in pcols
+    and qcols, which share one entry.
+    """
+
+    def __init__(self, ranktest_method, table=None):
+        self.ranktest_method = ranktest_method
+        self.table = {} if table is None else table
+        self.new_entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def getKey(pcols, qcols, kmax):
+        p = colsToBitset(pcols)
+        q = colsToBitset(qcols)
+        return (min(p, q), max(p, q), kmax)
+
+    def min_rank(self, pcols, qcols, kmax, alpha_dict):
+        return self.min_rank_batch([(pcols, qcols)], kmax, alpha_dict)[0]
+
+    def min_rank_batch(self, pairs, kmax, alpha_dict):
+        keys = [self.getKey(pcols, qcols, kmax) for pcols, qcols in pairs]
+
+        todo = {}
+        for i, key in enumerate(keys):
+            if key in self.table or key in todo:
+                self.hits += 1
+            else:
+                todo[key] = i
+                self.misses += 1
+
+        if len(todo) > 0:
+            min_ranks = self.ranktest_method.min_rank_batch([pairs[i] for i in todo.values()], kmax, alpha_dict)
+            for key, min_rank in zip(todo.keys(), min_ranks):
+                self.table[key] = min_rank
+                self.new_entries[key] = min_rank
+
+        return [self.table[key] for key in keys]
+
+    def popNewEntries(self):
+        '''
+        Entries added since the last call, to be merged back into the memo of
+        the parent process.
+        '''
+        new_entries = self.new_entries
+        self.new_entries = {}
+        return new_entries
+
+    def update(self, entries):
+        self.table.update(entries)
+
+
+def colsToBitset(cols):
+    bits = 0
+    for i in cols:
+        bits |= 1 << int(i)
+    return bits
@@ -0,0 +1,132 @@
+import os
+import pickle
+import shutil
+import tempfile
+import weakref
+from math import comb
+import joblib
+from joblib import delayed, Parallel
+
+# per worker process: the shared parameters and the LatentGroups of the
+# current round, loaded once and reused by every chunk the worker runs
+_WORKER_STATE = {'parameters_path': None, 'parameters': None, 'round_path': None, 'G': None}
+
+
+def _runChunk(parameters_path, round_path, k, chunk):
+    from StructureLearning.RLCD.RLCD_alg import findClusters_at_k_by_nonsinks
+
+    if _WORKER_STATE['parameters_path'] != parameters_path:
+        # copy-on-write memory map: the arrays stay shared with the other workers
+        _WORKER_STATE['parameters'] = joblib.load(parameters_path, mmap_mode='c')
+        _WORKER_STATE['parameters_path'] = parameters_path
+
+    parameters = _WORKER_STATE['parameters']
+    if _WORKER_STATE['round_path'] != round_path:
+        with open(round_path, 'rb') as f:
+            _WORKER_STATE['G'], memo_table = pickle.load(f)
+        if memo_table is not None:
+            parameters['rank_memo'].table = memo_table
+        _WORKER_STATE['round_path'] = round_path
+
+    G = _WORKER_STATE['G']
+    output = [(i, findClusters_at_k_by_nonsinks(G, k, nonsinks, parameters)) for i, nonsinks in chunk]
+    # rank outcomes found by this chunk, for the memo of the parent
+    new_entries = parameters['rank_memo'].popNewEntries() if parameters.get('rank_memo') is not None else {}
+    return output, new_entries
+
+
+class SearchPool(object):
+    """
+    Worker pool for the cluster search, kept for a whole RLCD call.
+
+    The search parameters (rank test, data, covariance) are dumped once per
+    partition to shared memory (/dev/shm when available) and memory mapped by
+    the workers. Each round only writes the current LatentGroups once; tasks
+    carry file paths and lists of nonsinks, so nothing large is pickled per
+    task. Tasks are grouped into chunks of similar estimated cost.
+
+    Use as a context manager (or call close()) to stop the workers and
+    remove the shared files; the files are also removed when the pool is
+    garbage collected or the interpreter exits.
+    """
+
+    def __init__(self, n_jobs=-1, chunks_per_worker=4):
+        shm = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        self.path = tempfile.mkdtemp(prefix="rlcd_pool_", dir=shm)
+        self.parallel = Parallel(n_jobs=n_jobs, backend='loky')
+        self.parallel.__enter__()
+        self._cleanup = weakref.finalize(self, shutil.rmtree, self.path, ignore_errors=True)
+        self.n_chunks = max(1, joblib.effective_n_jobs(n_jobs) * chunks_per_worker)
+        self.parameters_path = None
+        self.generation = 0
+
+    def share(self, parameters):
+        '''
+        Publish the parameters used by the following rounds, e.g. after the
+        rank test has been prepared for a new partition.
+        '''
+        if self.parameters_path is not None:
+            os.remove(self.parameters_path)
+        self.generation += 1
+        self.parameters_path = os.path.join(self.path, f"parameters_{self.generation}.pkl")
+        shared = {key: value for key, value in parameters.items() if key not in ('search_pool', 'search_stats', 'checkpoint_context', 'telemetry')}
+        joblib.dump(shared, self.parameters_path)
+
+    def run(self, G, k, input_list, rank_memo=None):
+        '''
+        findClusters_at_k_by_nonsinks(G, k, nonsinks, parameters) for every
+        nonsinks in input_list, returned in the order of input_list. The
+        workers start from the entries of rank_memo and the ones they add are
+        merged back into it.
+        '''
+        self.generation += 1
+        round_path = os.path.join(self.path, f"round_{self.generation}.pkl")
+        memo_table = None if rank_memo is None else rank_memo.table
+        with open(round_path, 'wb') as f:
+            pickle.dump((G, memo_table), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        chunks = self.getChunks(G, k, input_list)
+        try:
+            output = self.parallel(delayed(_runChunk)(self.parameters_path, round_path, k, chunk) for chunk in chunks)
+        finally:
+            os.remove(round_path)
+
+        output_list = [None] * len(input_list)
+        for chunk_output, new_entries in output:
+            for i, res in chunk_output:
+                output_list[i] = res
+            if rank_memo is not None:
+                rank_memo.update(new_entries)
+        return output_list
+
+    def getChunks(self, G, k, input_list):
+        '''
+        Longest-first greedy assignment of the tasks to n_chunks chunks, with
+        the cost of a task estimated by the number of subsets it enumerates.
+        Chunks are returned with the most expensive first.
+        '''
+        n_active = len(G.activeSet)
+        costs = [comb(max(n_active - len(nonsinks), 0), k - len(nonsinks) + 1) + 1 for nonsinks in input_list]
+        order = sorted(range(len(input_list)), key=lambda i: -costs[i])
+
+        n_chunks = min(self.n_chunks, len(input_list))
+        chunks = [[] for _ in range(n_chunks)]
+        loads = [0] * n_chunks
+        for i in order:
+            j = loads.index(min(loads))
+            chunks[j].append((i, input_list[i]))
+            loads[j] += costs[i]
+
+        return [chunk for _, chunk in sorted(zip(loads, chunks), key=lambda x: -x[0])]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if not self._cleanup.alive:
+            return
+        self.parallel.__exit__(None, None, None)
+        self._cleanup()
@@ -1,7 +1,7 @@
 from __future__ import annotations
 from copy import deepcopy
 from math import factorial as fac
-from math import sqrt
+from math import sqrt, log, exp, lgamma
 import numpy as np
 from numpy.linalg import matrix_rank
 from scipy.stats import norm
@@ -13,61 +13,93 @@ from utils.GraphDrawer import DotGraph
 from utils.logger import LOGGER
 from StructureLearning.RLCD.Cover import Cover
 
-def generateSubsetMinimal(vset, k=1):
+def generateSubsetMinimal(vset, k=1, prune=None, reverse=False):
     """
     Given a set of Covers, generate all minimum subsets s.t. cardinality > k.
+
+    Depth-first search over the Covers in descending cardinality, each one
+    either left out or added (unless it overlaps the subset so far), run with
+    an explicit stack and with subsets kept as bitmasks until they are
+    yielded. reverse=True yields the same subsets in the reverse order.
+
+    prune, if given, is called with the set of Covers of a branch whenever a
+    Cover is added to it; returning True drops the branch with all its
+    extensions, so it should only hold for sets whose supersets are all
+    unwanted too.
     """
 
-    def recursiveSearch(d, gap, currSubset=set()):
-        thread = f"currSubset: {currSubset}, d: {d}, gap is {gap}"
-        d = deepcopy(d)
-        currSubset = deepcopy(currSubset)
+    # Create dictionary where key is in descending dimension size
+    # and v is a set of Covers
+    d = {}
 
-        # Terminate if empty list
-        if len(d) == 0:
-            return set()
+    ordered_list = list(vset)
+    ordered_list.sort(key=lambda x: x.__hash__())
+
+    for v in ordered_list:
+        assert isinstance(v, Cover), "Should be Cover."
+        n = len(v)
+        d[n] = d.get(n, set()).union([v])
 
-        # Pop one Cover with largest cardinality
+    # Order in which the Covers are considered: the one with largest
+    # cardinality is popped from a fresh copy of its set at each level
+    order = []
+    while len(d) > 0:
+        d = {n: set(list(vs)) for n, vs in d.items()}
         maxDim = max(d)
-        v = d[maxDim].pop()
+        order.append(d[maxDim].pop())
         if len(d[maxDim]) == 0:
             d.pop(maxDim)
 
-        # Branch to consider all cases
-        # Continue current search without this element
-        if len(d) > 0:
-            yield from recursiveSearch(d, gap, currSubset)
+    m = len(order)
+    if m == 0:
+        return
 
-        # Add this group
-        if not groupInLatentSet(v, currSubset):
-            currSubset.add(v)
-            gap -= maxDim
+    var_index = {}
+    var_bits = []
+    for v in order:
+        bits = 0
+        for x in v.vars:
+            bits |= 1 << var_index.setdefault(x, len(var_index))
+        var_bits.append(bits)
 
-        # Continue search if gap not met
-        if gap >= 0 and len(d) > 0:
-            yield from recursiveSearch(d, gap, currSubset)
+    def getSubset(subset_bits):
+        return {order[i] for i in range(m) if subset_bits >> i & 1}
 
-        # End of search tree
-        if gap < 0:
-            yield currSubset
+    VISIT, YIELD = 0, 1
+    # (action, index of the next Cover, gap, subset bitmask, variable bitmask)
+    stack = [(VISIT, 0, k, 0, 0)]
+    while len(stack) > 0:
+        action, i, gap, subset_bits, used_bits = stack.pop()
+        if action == YIELD:
+            yield getSubset(subset_bits)
+            continue
 
-    #if k == 0:
-    #    return set()
+        steps = []
 
-    # Create dictionary where key is in descending dimension size
-    # and v is a list of frozensets of variables
-    d = {}
+        # Continue current search without this element
+        if i + 1 < m:
+            steps.append((VISIT, i + 1, gap, subset_bits, used_bits))
 
-    ordered_list = list(vset)
-    ordered_list.sort(key=lambda x: x.__hash__())
+        # Add this group
+        pruned = False
+        if used_bits & var_bits[i] == 0:
+            subset_bits |= 1 << i
+            used_bits |= var_bits[i]
+            gap -= len(order[i])
+            pruned = prune is not None and prune(getSubset(subset_bits))
 
-    for v in ordered_list:
-        assert isinstance(v, Cover), "Should be Cover."
-        n = len(v)
-        d[n] = d.get(n, set()).union([v])
+        if not pruned:
+            # Continue search if gap not met
+            if gap >= 0 and i + 1 < m:
+                steps.append((VISIT, i + 1, gap, subset_bits, used_bits))
+
+            # End of search tree
+            if gap < 0:
+                steps.append((YIELD, i, gap, subset_bits, used_bits))
 
-    # Run recursive search
-    yield from recursiveSearch(d, k)
+        if reverse:
+            steps.reverse()
+        stack.extend(reversed(steps))
 
 
 # Check if new group of latent vars exists in a current
@@ -125,6 +157,19 @@ def findEntry(latentDict, refChildren, subgroupMeasures):
 # S: Sample Covariance
 # I, J: Disjoint index sets, |I| = |J|
 def traceMatrixCompound(S, I, J, k):
+    """
+    (-1)^k times the sum of the k x k principal minors of A. The sum of the
+    principal minors is the k-th elementary symmetric polynomial of the
+    eigenvalues of A, i.e. (-1)^k times the k-th coefficient of its
+    characteristic polynomial, so all k cost one eigendecomposition.
+    """
+    return compoundTraces(S, I, J)[k]
+
+
+def compoundTraces(S, I, J):
+    """
+    traceMatrixCompound(S, I, J, k) for all k = 0..|I| at once.
+    """
     X = I + J  # Union of I and J
     SijInv = np.linalg.inv(S[np.ix_(X, X)])
     Inew = [X.index(i) for i in I]
@@ -132,45 +177,46 @@ def traceMatrixCompound(S, I, J, k):
     Sij = SijInv[np.ix_(Inew, Jnew)]
     Sji = S[np.ix_(J, I)]
     A = Sji @ Sij
+    return np.real(np.poly(A))
 
-    m = A.shape[0]
-    Sum = 0
-    for Vs in combinations(range(m), k):
-        Vs = list(Vs)
-        Atemp = A[np.ix_(Vs, Vs)]
-        Sum += np.linalg.det(Atemp)
-    Sum = pow(-1, k) * Sum
-    # print(f"traceMatrixCompound is {Sum}")
-    return Sum
 
+# log of the falling factorial a! / (a-b)!
+def logFallingFactorial(a, b):
+    return lgamma(a + 1) - lgamma(a - b + 1)
 
-def determinantVariance(S, I, J, n):
+
+def determinantVariance(S, I, J, n, scaled=False):
+    """
+    Variance of det(n * S[I, J]). Factorial ratios are evaluated with
+    log-gamma so large n does not overflow. With scaled=True the variance of
+    det(S[I, J]) is returned instead, which stays representable for any n.
+    """
     assert len(I) == len(J), "I and J must be same length"
     m = len(I)
     X = I + J
     SijDet = np.linalg.det(S[np.ix_(I, J)])
     SijijDet = np.linalg.det(S[np.ix_(X, X)])
-    # print(f"SijDet is {SijDet}")
+    traces = compoundTraces(S, I, J)
+
+    # every term is divided by n^(2m) and multiplied back if not scaled
+    logn = log(n)
+    ffn = exp(logFallingFactorial(n, m) - m * logn)
+    ffn2 = exp(logFallingFactorial(n + 2, m) - m * logn)
 
     Sum = 0
     for k in range(m):
-        Sum += (
-            fac(m - k) * fac(n + 2) / fac(n + 2 - k) * traceMatrixCompound(S, I, J, k)
-        )
-    firstTerm = (
-        fac(n)
-        / fac(n - m)
-        * pow(SijDet, 2)
-        * (fac(n + 2) / fac(n + 2 - m) - fac(n) / fac(n - m))
-    )
-    secondTerm = fac(n) / fac(n - m) * SijijDet * Sum
+        Sum += exp(lgamma(m - k + 1) + logFallingFactorial(n + 2, k) - m * logn) * traces[k]
+    firstTerm = ffn * pow(SijDet, 2) * (ffn2 - ffn)
+    secondTerm = ffn * SijijDet * Sum
     variance = firstTerm + secondTerm
 
     # Heuristic (better way to handle negative variance?)
     if variance < 0:
-        return 1
-    else:
+        return exp(-2 * m * logn) if scaled else 1
+    elif scaled:
         return variance
+    else:
+        return variance * exp(2 * m * logn)
 
 
 def determinantMean(S, I, J, n):
@@ -181,8 +227,9 @@ def determinantMean(S, I, J, n):
 
 # Returns p value
 def determinantTest(S, I, J, n):
-    detMean = determinantMean(S, I, J, n)
-    detVar = determinantVariance(S, I, J, n)
+    # compare det(S[I, J]) with its sd on the 1/n scale to avoid overflow
+    detMean = np.linalg.det(S[np.ix_(I, J)])
+    detVar = determinantVariance(S, I, J, n, scaled=True)
     zStat = abs(detMean) / sqrt(detVar)
     pValue = (1 - norm.cdf(zStat)) * 2
     return pValue
@@ -314,6 +361,26 @@ def powerset(iterable):
     return chain.from_iterable(combinations(s, r) for r in range(len(s) + 1))
 
 
+def reversedPowerset(iterable):
+    """
+    Lazily generate reversed(list(powerset(iterable))): the full set first,
+    then the subsets of each smaller size in reverse lexicographic order, the
+    empty set last.
+    """
+    s = list(iterable)
+
+    def _reversedCombinations(start, r):
+        if r == 0:
+            yield ()
+            return
+        for i in range(len(s) - r, start - 1, -1):
+            for rest in _reversedCombinations(i + 1, r - 1):
+                yield (s[i],) + rest
+
+    for r in range(len(s), -1, -1):
+        yield from _reversedCombinations(0, r)
+
+
 def clearOutputFolder():
     # Clear output folder
     files = glob.glob("output/*.pkl") + glob.glob("output/*.png")
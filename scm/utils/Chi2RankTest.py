@@ -1,186 +1,428 @@
 import numpy as np
-from pdb import set_trace
-from statsmodels.multivariate.cancorr import CanCorr
-from math import log, pow
+from functools import lru_cache
+from collections import OrderedDict
 from scipy.stats import chi2
-from scipy.linalg import eigh
+from scipy.linalg import cholesky, solve_triangular, LinAlgError
+from utils.LazyCrossProducts import LazyCrossProducts
+from utils.logger import LOGGER
+from utils.PolychoricCorrelation import polychoric_correlation_matrix
 
 
 class Chi2RankTest(object):
 
     def __init__(self, data, N_scaling=1):
 
-        self.data = data
-        self.data = self.data - self.data.mean(axis=0)
-        self.data = self.data/self.data.std(axis=0)
+        data = data - data.mean(axis=0)
+        data /= data.std(axis=0)
 
-        self.N = data.shape[0]
+        self._setup(data.T@data, data.shape[0], N_scaling) # data are zero mean
+
+    def _setup(self, unnormalized_crosscovs, N, N_scaling, conditioning_cache_size=64):
+
+        self.N = N
+        self.n_vars = unnormalized_crosscovs.shape[0]
         self.N_scaling = N_scaling
-        self.unnormalized_crosscovs = self.data.T@self.data # data are zero mean
+        self.unnormalized_crosscovs = unnormalized_crosscovs
         self.cca_cache_dict = {}
 
-    def get_cachekey(self, pcols_, qcols_):
+        # whitened projections onto shared (conditioning) column blocks, LRU
+        self.conditioning_cache = OrderedDict()
+        self.conditioning_cache_size = conditioning_cache_size
 
-        pcols = pcols_.copy()
-        qcols = qcols_.copy()
-        pcols.sort()
-        qcols.sort()
-
-        key = ''
-        for i in range(self.data.shape[1]):
-            if i in pcols and i in qcols:
-                key = key+str(3)
-            elif i in pcols and not i in qcols:
-                key = key+str(2)
-            elif not i in pcols and i in qcols:
-                key = key+str(1)
-            else:
-                key = key+str(0)
+        # cheap rejection screen in front of the exact solve, see screen_rejects
+        self.screen = True
+        self.screen_verify = False
+        self.screen_counts = {'screen_rejections': 0, 'screen_mismatches': 0}
 
-        return key
+    @classmethod
+    def from_covariance(cls, cov, N, N_scaling=1):
+        '''
+        Build the test from a covariance (or correlation) matrix of N samples,
+        without the raw data.
+        '''
+        cov = np.asarray(cov, dtype=float)
+        sd = np.sqrt(np.diag(cov))
 
-    def test(self, pcols, qcols, r, alpha):
+        test = cls.__new__(cls)
+        test._setup(N * cov / np.outer(sd, sd), N, N_scaling) # N * correlation, as from standardized data
+        return test
+
+    @classmethod
+    def from_wide_data(cls, data, N_scaling=1, dtype=np.float64, memory_budget=1 << 30):
         '''
-        Parameters
-        ----------
-        pcols, qcols : column indices of data
-        r: null hypo that rank <= r
-        alpha: significance level
+        Build the test without the dense p x p cross-product matrix: blocks are
+        computed from the data on demand (see LazyCrossProducts), within
+        memory_budget bytes and optionally stored in float32.
+        '''
+        test = cls.__new__(cls)
+        test._setup(LazyCrossProducts(data, dtype, memory_budget), data.shape[0], N_scaling)
+        return test
 
-        Returns
-        -------
-        if_fail_to_reject: 0 means reject and 1 means fail to reject
-        p : the p-value of the test
+    @classmethod
+    def from_ordinal(cls, data, N_scaling=1, n_jobs=-1):
+        '''
+        Build the test for ordinal (e.g. thresholded or survey) data from its
+        polychoric correlation matrix, estimated once per dataset, with N
+        replaced by the effective sample size of the polychoric estimates.
+        '''
+        R, N_eff = polychoric_correlation_matrix(data, n_jobs=n_jobs)
+        return cls.from_covariance(R, N_eff, N_scaling)
+
+    @classmethod
+    def from_moments(cls, moments, N_scaling=1):
+        '''
+        Build the test from a StreamingMoments accumulated over the data in blocks.
         '''
+        return cls.from_covariance(moments.covariance(), moments.n, N_scaling)
 
+    def get_cachekey(self, pcols_, qcols_):
 
+        # one digit per column: 3 in both, 2 in pcols only, 1 in qcols only, 0 in neither
+        key = bytearray(b'0' * self.n_vars)
+        qset = set(qcols_)
+        for i in qset:
+            key[i] = ord('1')
+        for i in set(pcols_):
+            key[i] = ord('3') if i in qset else ord('2')
+        key = key.decode()
+
+        # canonical correlations are symmetric in (pcols, qcols), so (p,q)
+        # and (q,p) share one entry
+        swapped = key.translate(str.maketrans('21', '12'))
+        return min(key, swapped)
+
+    def crosscovs(self, X, Y):
+        '''
+        The block S[X, Y] of the unnormalized cross-covariance.
+        '''
+        S = self.unnormalized_crosscovs
+        if isinstance(S, LazyCrossProducts):
+            return S.block(X, Y)
+        return S[np.ix_(X, Y)]
 
-        cachekey = self.get_cachekey(pcols, qcols)
+    def prefetch_columns(self, cols):
+        '''
+        Hint that the coming tests use the columns cols, e.g. one stage-2
+        partition, so a lazily computed S can materialize that block at once.
+        '''
+        if isinstance(self.unnormalized_crosscovs, LazyCrossProducts):
+            self.unnormalized_crosscovs.prefetch(cols)
 
-        if cachekey in self.cca_cache_dict:
-            cancorr = self.cca_cache_dict[cachekey]
+    def get_conditioning_block(self, shared, cols):
+        '''
+        T = W.T @ S[shared, :] with W whitening S[shared, shared], so that
+        S[X, shared] S[shared, shared]^{-1} S[shared, Y] = T[:, X].T @ T[:, Y].
+        Kept in an LRU cache, since the tests of a round mostly share the same
+        nonsink columns. The columns of T are filled in as they are requested
+        (cols), so T never needs a full row block of S.
+        '''
+        key = tuple(shared)
+        if key in self.conditioning_cache:
+            self.conditioning_cache.move_to_end(key)
+            W, T, done = self.conditioning_cache[key]
         else:
+            W = _inv_sqrt(self.crosscovs(shared, shared))
+            T = np.zeros((len(shared), self.n_vars))
+            done = np.zeros(self.n_vars, dtype=bool)
+            self.conditioning_cache[key] = (W, T, done)
+            if len(self.conditioning_cache) > self.conditioning_cache_size:
+                self.conditioning_cache.popitem(last=False)
+
+        cols = np.asarray(cols, dtype=int)
+        missing = np.unique(cols[~done[cols]])
+        if len(missing) > 0:
+            T[:, missing] = W.T @ self.crosscovs(shared, missing)
+            done[missing] = True
+        return T
+
+    def partial_crosscovs(self, shared, X, Y):
+        '''
+        Schur complement S[X, Y | shared] = S[X, Y] - S[X, shared] S[shared, shared]^{-1} S[shared, Y],
+        from the cached block of shared, so each extra column costs one column of T.
+        '''
+        if len(shared) == 0:
+            return self.crosscovs(X, Y)
+        T = self.get_conditioning_block(shared, list(X) + list(Y))
+        return self.crosscovs(X, Y) - T[:, X].T @ T[:, Y]
 
-            X = self.data[:, pcols]
-            Y = self.data[:, qcols]
+    def cancorr(self, pcols, qcols):
+        '''
+        Canonical correlations between data[:, pcols] and data[:, qcols],
+        computed from the cached cross-product blocks only (no pass over the
+        N rows), in descending order.
 
-            unnormalized_crosscovs = [self.unnormalized_crosscovs[pcols,:][:,pcols], self.unnormalized_crosscovs[pcols,:][:,qcols], \
-                         self.unnormalized_crosscovs[qcols,:][:,pcols], self.unnormalized_crosscovs[qcols,:][:,qcols]]
+        Columns in both pcols and qcols contribute canonical correlations of
+        one; the rest are the partial canonical correlations of the remaining
+        columns given the shared ones.
+        '''
+        shared, A, B = split_shared_cols(pcols, qcols)
+        partial = np.zeros(0)
+        if len(A) > 0 and len(B) > 0:
+            partial = cancorr_from_crosscovs(self.partial_crosscovs(shared, A, A), self.partial_crosscovs(shared, A, B), \
+                                             self.partial_crosscovs(shared, B, B))
+        return np.concatenate([np.ones(len(shared)), partial])
+
+    def get_cancorr(self, pcols, qcols):
+        '''
+        Cached canonical correlations between pcols and qcols.
+        '''
+        cachekey = self.get_cachekey(pcols, qcols)
 
-            try:
-                comps = kcca_modified([X, Y], reg=0.,
-                    numCC=None, kernelcca=False, ktype='linear',
-                    gausigma=1.0, degree=2, crosscovs = unnormalized_crosscovs)
+        if cachekey in self.cca_cache_dict:
+            cancorr = self.cca_cache_dict[cachekey]
+        else:
+            cancorr = self.cancorr(pcols, qcols)
+            self.cca_cache_dict[cachekey] = cancorr
 
-                cancorr, _, _ = recon([X,Y], comps, kernelcca=False)
-                cancorr = cancorr[:,0,1]
-            except:
-                print(f"calculating cancorr error {pcols} {qcols}, using slower implementation instead")
-                cancorr = CanCorr(X, Y, tolerance=1e-8).cancorr
+        return cancorr
 
-            self.cca_cache_dict[cachekey] = cancorr
+    def get_cancorr_batch(self, pairs):
+        '''
+        Cached canonical correlations for a list of (pcols, qcols) pairs. The
+        cache misses are grouped by their shared columns and the sizes of the
+        remaining blocks, and each group is solved with one stacked eigh/svd
+        call.
+        '''
+        cachekeys = [self.get_cachekey(pcols, qcols) for pcols, qcols in pairs]
+
+        groups = {}
+        for i, cachekey in enumerate(cachekeys):
+            if cachekey in self.cca_cache_dict:
+                continue
+            shared, A, B = split_shared_cols(*pairs[i])
+            group = groups.setdefault((tuple(shared), len(A), len(B)), {})
+            group.setdefault(cachekey, (A, B))
+
+        for (shared, a, b), group in groups.items():
+            shared = list(shared)
+            if a == 0 or b == 0:
+                partials = np.zeros((len(group), 0))
+            else:
+                A = np.array([A for A, B in group.values()])
+                B = np.array([B for A, B in group.values()])
+                # one block over all columns of the group, indexed locally
+                cols = np.unique(np.concatenate([A.ravel(), B.ravel()]))
+                S = self.crosscovs(cols, cols)
+                a_idx = np.searchsorted(cols, A)
+                b_idx = np.searchsorted(cols, B)
+                Sxx = S[a_idx[:, :, None], a_idx[:, None, :]]
+                Sxy = S[a_idx[:, :, None], b_idx[:, None, :]]
+                Syy = S[b_idx[:, :, None], b_idx[:, None, :]]
+                if len(shared) > 0:
+                    T = self.get_conditioning_block(shared, cols)
+                    TA = np.moveaxis(T[:, A], 0, -1) # (batch, a, |shared|)
+                    TB = np.moveaxis(T[:, B], 0, -1)
+                    Sxx = Sxx - TA @ np.swapaxes(TA, -1, -2)
+                    Sxy = Sxy - TA @ np.swapaxes(TB, -1, -2)
+                    Syy = Syy - TB @ np.swapaxes(TB, -1, -2)
+                partials = cancorr_from_crosscovs(Sxx, Sxy, Syy)
+            for cachekey, partial in zip(group.keys(), partials):
+                self.cca_cache_dict[cachekey] = np.concatenate([np.ones(len(shared)), partial])
+
+        return [self.cca_cache_dict[cachekey] for cachekey in cachekeys]
+
+    def fail_to_reject(self, cancorr, p, q, r, alpha):
+        '''
+        Bartlett's chi2 test of H0: rank <= r, given the canonical
+        correlations of a p x q cross-covariance.
+        '''
+        l = np.minimum(cancorr[r:], 1-1e-15)
+        testStat = -np.log(1-l*l).sum()
 
-        testStat = 0
-        p = len(pcols)
-        q = len(qcols)
-        
-        l = cancorr[r:]
-        for li in l:
-            li = min(li, 1-1e-15)
-            testStat += log(1)-log(1-li*li)
         ratio = 0
         for i in range(r):
-            li = cancorr[i]
+            li = max(cancorr[i], 1e-15)
             ratio += 1/(li*li)-1
 
         ratio += self.N*self.N_scaling - r - 0.5*(p+q+1)
         testStat = testStat * ratio
 
         dfreedom = (p-r) * (q-r)
-        criticalValue = chi2.ppf(1-alpha, dfreedom)
-        p = 1 - chi2.cdf(testStat, dfreedom)
-        if_fail_to_reject = testStat<=criticalValue
+        criticalValue = chi2_critical_value(dfreedom, alpha)
 
         # due to numerical errors comparing criticalValue with testStat is more accurate 
+        return testStat<=criticalValue
+
+    def test(self, pcols, qcols, r, alpha):
+        '''
+        Parameters
+        ----------
+        pcols, qcols : column indices of data
+        r: null hypo that rank <= r
+        alpha: significance level
+
+        Returns
+        -------
+        if_fail_to_reject: 0 means reject and 1 means fail to reject
+        '''
 
-        return if_fail_to_reject
-
-
-def kcca_modified(
-        data, reg=0.0, numCC=None, kernelcca=False, ktype="linear", gausigma=1.0, degree=2, crosscovs=None
-):
-    """Set up and solve the kernel CCA eigenproblem"""
-    if kernelcca:
-        raise NotImplementedError
-        #kernel = [
-        #    _make_kernel(d, ktype=ktype, gausigma=gausigma, degree=degree) for d in data
-        #]
-    else:
-        kernel = [d.T for d in data]
-
-    nDs = len(kernel)
-    nFs = [k.shape[0] for k in kernel]
-    numCC = min([k.shape[0] for k in kernel]) if numCC is None else numCC
-
-    # Get the auto- and cross-covariance matrices
-    if crosscovs is None:
-        crosscovs = [np.dot(ki, kj.T) for ki in kernel for kj in kernel]
-
-    # Allocate left-hand side (LH) and right-hand side (RH):
-    n = sum(nFs)
-    LH = np.zeros((n, n))
-    RH = np.zeros((n, n))
-
-    # Fill the left and right sides of the eigenvalue problem
-    for i in range(nDs):
-        RH[
-        sum(nFs[:i]): sum(nFs[: i + 1]), sum(nFs[:i]): sum(nFs[: i + 1])
-        ] = crosscovs[i * (nDs + 1)] + reg * np.eye(nFs[i])
-
-        for j in range(nDs):
-            if i != j:
-                LH[
-                sum(nFs[:j]): sum(nFs[: j + 1]), sum(nFs[:i]): sum(nFs[: i + 1])
-                ] = crosscovs[nDs * j + i]
-
-    LH = (LH + LH.T) / 2.0
-    RH = (RH + RH.T) / 2.0
-
-    maxCC = LH.shape[0]
-    r, Vs = eigh(LH, RH, eigvals=(maxCC - numCC, maxCC - 1))
-    r[np.isnan(r)] = 0
-    rindex = np.argsort(r)[::-1]
-    comp = []
-    Vs = Vs[:, rindex]
-    for i in range(nDs):
-        comp.append(Vs[sum(nFs[:i]): sum(nFs[: i + 1]), :numCC])
-    return comp
-
-def _listdot(d1, d2):
-    return [np.dot(x[0].T, x[1]) for x in zip(d1, d2)]
-
-def _listcorr(a):
-    """Returns pairwise row correlations for all items in array as a list of matrices"""
-    corrs = np.zeros((a[0].shape[1], len(a), len(a)))
-    for i in range(len(a)):
-        for j in range(len(a)):
-            if j > i:
-                corrs[:, i, j] = [
-                    np.nan_to_num(np.corrcoef(ai, aj)[0, 1])
-                    for (ai, aj) in zip(a[i].T, a[j].T)
-                ]
-    return corrs
-
-def recon(data, comp, corronly=False, kernelcca=False):
-    # Get canonical variates and CCs
-    if kernelcca:
-        ws = _listdot(data, comp)
-    else:
-        ws = comp
-    ccomp = _listdot([d.T for d in data], ws)
-    corrs = _listcorr(ccomp)
-    if corronly:
-        return corrs
-    else:
-        return corrs, ws, ccomp
-    
+        cancorr = self.get_cancorr(pcols, qcols)
+        return self.fail_to_reject(cancorr, len(pcols), len(qcols), r, alpha)
+
+    def screen_rejects(self, pcols, qcols, kmax, alpha):
+        '''
+        Cheap sufficient condition for rejecting H0: rank <= kmax, checked
+        before the exact eigen solve.
+
+        With c = N' - kmax - (p+q+1)/2 the statistic is at least
+        c * sum_{i>=kmax} l_i^2. Shared columns give l_i = 1; for the partial
+        canonical correlations rho of the remaining blocks,
+        sum_{i>=k'} rho_i^2 >= ||M||_F^2 - k' with M the whitened partial
+        cross-covariance (two Cholesky solves, no eigen decomposition), and for
+        k' = 0 it is at least the largest squared partial correlation of
+        single columns (no solve at all). Only ever returns True when the exact
+        test would reject, so the search outcome is unchanged.
+        '''
+        if not self.screen or self.get_cachekey(pcols, qcols) in self.cca_cache_dict:
+            return False
+
+        p = len(pcols)
+        q = len(qcols)
+        c = self.N*self.N_scaling - kmax - 0.5*(p+q+1)
+        criticalValue = chi2_critical_value((p-kmax) * (q-kmax), alpha)
+        if c <= 0 or not np.isfinite(criticalValue):
+            return False
+        threshold = criticalValue * (1+1e-9) / c
+
+        return self.screen_bound(pcols, qcols, kmax, threshold) > threshold
+
+    def screen_bound(self, pcols, qcols, kmax, threshold=np.inf):
+        '''
+        The lower bound of screen_rejects on the test statistic of
+        H0: rank <= kmax, divided by c; 0 when no bound is available. Stops as
+        soon as a bound exceeds threshold. Small values mark the pairs most
+        likely to be rank deficient.
+        '''
+        shared, A, B = split_shared_cols(pcols, qcols)
+
+        kp = kmax - len(shared)
+        if kp < 0:
+            l = 1-1e-15 # as clipped in fail_to_reject
+            return -kp * -np.log(1-l*l)
+        if len(A) == 0 or len(B) == 0:
+            return 0
+
+        Sxx = self.partial_crosscovs(shared, A, A)
+        Sxy = self.partial_crosscovs(shared, A, B)
+        Syy = self.partial_crosscovs(shared, B, B)
+
+        bound = 0
+        if kp == 0:
+            partialcorr2 = Sxy * Sxy / np.outer(np.diag(Sxx), np.diag(Syy))
+            bound = partialcorr2.max()
+            if bound > threshold:
+                return bound
+
+        try:
+            Lx = cholesky(Sxx, lower=True)
+            Ly = cholesky(Syy, lower=True)
+        except LinAlgError:
+            return bound
+        M = solve_triangular(Ly, solve_triangular(Lx, Sxy, lower=True).T, lower=True)
+        return max(bound, (M*M).sum() - kp)
+
+    def screened_min_rank(self, pcols, qcols, kmax, alpha_dict):
+        '''
+        Apply the screen to one test. Returns True if it was screened out
+        (i.e. min_rank is None).
+        '''
+        if not self.screen_rejects(pcols, qcols, kmax, alpha_dict[kmax]):
+            return False
+
+        self.screen_counts['screen_rejections'] += 1
+        if self.screen_verify:
+            cancorr = self.get_cancorr(pcols, qcols)
+            if self.min_rank_from_cancorr(cancorr, len(pcols), len(qcols), kmax, alpha_dict) is not None:
+                self.screen_counts['screen_mismatches'] += 1
+                LOGGER.warning(f"rank screen rejected {pcols} {qcols} at rank {kmax} but the exact test does not")
+        return True
+
+    def min_rank(self, pcols, qcols, kmax, alpha_dict):
+        '''
+        Smallest rank r <= kmax such that H0: rank <= h is not rejected for
+        every h in r..kmax, all from one canonical-correlation vector.
+
+        Returns
+        -------
+        min_rank: None if rank <= kmax is already rejected
+        '''
+        if self.screened_min_rank(pcols, qcols, kmax, alpha_dict):
+            return None
+
+        cancorr = self.get_cancorr(pcols, qcols)
+        return self.min_rank_from_cancorr(cancorr, len(pcols), len(qcols), kmax, alpha_dict)
+
+    def min_rank_batch(self, pairs, kmax, alpha_dict):
+        '''
+        min_rank for a list of (pcols, qcols) pairs, with the canonical
+        correlations solved in shape-grouped batches for the pairs the screen
+        does not reject.
+        '''
+        min_ranks = [None] * len(pairs)
+        todo = [i for i, (pcols, qcols) in enumerate(pairs) if not self.screened_min_rank(pcols, qcols, kmax, alpha_dict)]
+
+        cancorrs = self.get_cancorr_batch([pairs[i] for i in todo])
+        for i, cancorr in zip(todo, cancorrs):
+            pcols, qcols = pairs[i]
+            min_ranks[i] = self.min_rank_from_cancorr(cancorr, len(pcols), len(qcols), kmax, alpha_dict)
+
+        return min_ranks
+
+    def min_rank_from_cancorr(self, cancorr, p, q, kmax, alpha_dict):
+
+        min_rank = None
+        for r in range(kmax, -1, -1):
+            if not self.fail_to_reject(cancorr, p, q, r, alpha_dict[r]):
+                break
+            min_rank = r
+
+        return min_rank
+
+
+def split_shared_cols(pcols, qcols):
+    """
+    Split (pcols, qcols) into the sorted columns they share and the sorted
+    columns only in pcols / only in qcols.
+    """
+    shared = set(pcols).intersection(qcols)
+    A = sorted(set(pcols) - shared)
+    B = sorted(set(qcols) - shared)
+    return sorted(shared), A, B
+
+
+@lru_cache(maxsize=None)
+def chi2_critical_value(dfreedom, alpha):
+    """
+    Table of chi2 critical values, filled once per (dof, alpha).
+    """
+    return chi2.ppf(1-alpha, dfreedom)
+
+
+def _inv_sqrt(S, tol=1e-10):
+    """
+    Whitening matrix W with W.T @ S @ W = I on the numerical range of S, for
+    one matrix or a stack of them (..., n, n). Eigen-directions with
+    eigenvalue below tol * max eigenvalue get a zero column, so rank deficient
+    (e.g. duplicated) columns do not blow up.
+    """
+    S = (S + np.swapaxes(S, -1, -2)) / 2.0
+    w, V = np.linalg.eigh(S)
+    keep = w > tol * np.maximum(w.max(axis=-1, keepdims=True), 0)
+    scale = np.where(keep, 1 / np.sqrt(np.where(keep, w, 1)), 0)
+    return V * scale[..., None, :]
+
+def cancorr_from_crosscovs(Sxx, Sxy, Syy):
+    """
+    Canonical correlations from the covariance blocks of X and Y (any common
+    scaling, e.g. unnormalized cross-products), as the singular values of the
+    whitened cross-covariance Sxx^{-1/2} Sxy Syy^{-1/2}.
+
+    Costs O((p+q)^3) regardless of the sample size. The blocks may be stacked
+    along leading axes to solve many same-shape problems at once. Returns
+    min(p, q) values per problem in descending order, clipped to [0, 1];
+    numerically degenerate directions contribute zeros.
+    """
+    Wx = _inv_sqrt(Sxx)
+    Wy = _inv_sqrt(Syy)
+    s = np.linalg.svd(np.swapaxes(Wx, -1, -2) @ Sxy @ Wy, compute_uv=False)
+    return np.clip(s, 0, 1)
@@ -0,0 +1,119 @@
+import numpy as np
+from itertools import combinations
+import StructureLearning.RLCD.misc as M
+from utils.Chi2RankTest import split_shared_cols
+
+
+class DeterminantRankTest(object):
+    """
+    Rank test on the sub-covariance [pcols, qcols] through the asymptotic
+    normal test of its (r+1) x (r+1) minors (misc.determinantTest), combined
+    with a Bonferroni correction.
+
+    rank <= r holds iff every (r+1)-minor vanishes. Minors whose row and column
+    sets overlap are singular in the variance formula, so as in
+    Chi2RankTest.cancorr, columns in both pcols and qcols are taken out first:
+    each adds one to the rank, and the minors tested are those of the partial
+    correlation of the remaining columns given the shared ones, against the
+    rank budget left. Same interface as Chi2RankTest, meant as a cheap
+    cross-check of it on large N.
+    """
+
+    def __init__(self, data, N_scaling=1):
+
+        data = data - data.mean(axis=0)
+        data /= data.std(axis=0)
+
+        self.N = data.shape[0]
+        self.n_vars = data.shape[1]
+        self.N_scaling = N_scaling
+        self.cov = data.T@data/self.N
+        self.pvalue_cache_dict = {}
+
+    @classmethod
+    def from_covariance(cls, cov, N, N_scaling=1):
+        '''
+        Build the test from a covariance (or correlation) matrix of N samples,
+        without the raw data.
+        '''
+        cov = np.asarray(cov, dtype=float)
+        sd = np.sqrt(np.diag(cov))
+
+        test = cls.__new__(cls)
+        test.N = N
+        test.n_vars = cov.shape[0]
+        test.N_scaling = N_scaling
+        test.cov = cov / np.outer(sd, sd)
+        test.pvalue_cache_dict = {}
+        return test
+
+    def partial_corr(self, shared, cols):
+        '''
+        Partial correlation matrix of cols given the columns shared.
+        '''
+        S = self.cov[np.ix_(cols, cols)]
+        if len(shared) > 0:
+            C = self.cov[np.ix_(cols, shared)]
+            S = S - C @ np.linalg.pinv(self.cov[np.ix_(shared, shared)]) @ C.T
+        sd = np.sqrt(np.diag(S))
+        return S / np.outer(sd, sd)
+
+    def minor_pvalue(self, shared, I, J):
+        '''
+        p-value of H0: det(cov[I, J | shared]) = 0, cached per (shared, I, J).
+        '''
+        I, J = tuple(sorted(I)), tuple(sorted(J))
+        if J < I:
+            I, J = J, I
+        key = (tuple(shared), I, J)
+
+        if key not in self.pvalue_cache_dict:
+            S = self.partial_corr(list(shared), list(I) + list(J))
+            # one degree of freedom less per conditioning column
+            n = self.N*self.N_scaling - len(shared)
+            self.pvalue_cache_dict[key] = M.determinantTest(S, list(range(len(I))), list(range(len(I), len(I) + len(J))), n)
+        return self.pvalue_cache_dict[key]
+
+    def test(self, pcols, qcols, r, alpha):
+        '''
+        Parameters
+        ----------
+        pcols, qcols : column indices of data
+        r: null hypo that rank <= r
+        alpha: significance level
+
+        Returns
+        -------
+        if_fail_to_reject: 0 means reject and 1 means fail to reject
+        '''
+        shared, A, B = split_shared_cols(pcols, qcols)
+
+        # every shared column takes one from the rank budget
+        r = r - len(shared)
+        if r < 0:
+            return False
+        if r >= min(len(A), len(B)):
+            return True
+
+        plist = []
+        for I in combinations(A, r+1):
+            for J in combinations(B, r+1):
+                plist.append(self.minor_pvalue(shared, I, J))
+
+        return M.bonferroniTest(plist, alpha)
+
+    def min_rank(self, pcols, qcols, kmax, alpha_dict):
+        '''
+        Smallest rank r <= kmax such that H0: rank <= h is not rejected for
+        every h in r..kmax. None if rank <= kmax is already rejected.
+        '''
+        min_rank = None
+        for r in range(kmax, -1, -1):
+            if not self.test(pcols, qcols, r, alpha_dict[r]):
+                break
+            min_rank = r
+
+        return min_rank
+
+    def min_rank_batch(self, pairs, kmax, alpha_dict):
+        return [self.min_rank(pcols, qcols, kmax, alpha_dict) for pcols, qcols in pairs]
@@ -0,0 +1,77 @@
+import numpy as np
+from collections import OrderedDict
+from utils.logger import LOGGER
+
+
+class LazyCrossProducts(object):
+    """
+    Stand-in for the dense p x p matrix Z.T @ Z of standardized data Z, for
+    data sets too wide to hold it. Blocks Z[:, X].T @ Z[:, Y] are computed on
+    request from the (standardized) data.
+
+    prefetch(cols) materializes the block over one column set, e.g. the
+    columns of a stage-2 partition, and later requests inside that set are
+    sliced out of it. Blocks are kept in an LRU cache bounded by
+    memory_budget bytes, optionally stored in float32; blocks are always
+    returned in float64.
+    """
+
+    def __init__(self, data, dtype=np.float64, memory_budget=1 << 30):
+
+        data = np.array(data, dtype=dtype)
+        data -= data.mean(axis=0)
+        data /= data.std(axis=0)
+
+        self.data = data
+        self.dtype = np.dtype(dtype)
+        self.shape = (data.shape[1], data.shape[1])
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+
+        # tuple(cols) -> (block over cols, position of each col in block)
+        self.blocks = OrderedDict()
+
+    def compute(self, X, Y):
+        return (self.data[:, X].T @ self.data[:, Y]).astype(np.float64)
+
+    def prefetch(self, cols):
+        '''
+        Materialize the block over cols, evicting the least recently used
+        blocks beyond the memory budget.
+        '''
+        cols = tuple(sorted(set(cols)))
+        if cols in self.blocks:
+            self.blocks.move_to_end(cols)
+            return
+
+        nbytes = len(cols) * len(cols) * self.dtype.itemsize
+        if nbytes > self.memory_budget:
+            LOGGER.warning(f"block over {len(cols)} columns ({nbytes} bytes) exceeds the memory budget, computing on demand")
+            return
+
+        while self.memory_used + nbytes > self.memory_budget:
+            _, (evicted, _) = self.blocks.popitem(last=False)
+            self.memory_used -= evicted.nbytes
+
+        block = self.compute(list(cols), list(cols)).astype(self.dtype)
+        position = np.full(self.shape[0], -1)
+        position[list(cols)] = np.arange(len(cols))
+        self.blocks[cols] = (block, position)
+        self.memory_used += block.nbytes
+
+    def block(self, X, Y):
+        '''
+        Z[:, X].T @ Z[:, Y], from the most recently used cached block holding
+        all of X and Y, or computed from the data otherwise.
+        '''
+        X = np.asarray(X, dtype=int)
+        Y = np.asarray(Y, dtype=int)
+        for cols in reversed(self.blocks):
+            block, position = self.blocks[cols]
+            x = position[X]
+            y = position[Y]
+            if (x >= 0).all() and (y >= 0).all():
+                self.blocks.move_to_end(cols)
+                return block[np.ix_(x, y)].astype(np.float64)
+
+        return self.compute(X, Y)
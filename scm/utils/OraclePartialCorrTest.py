@@ -5,13 +5,14 @@ NO_SPECIFIED_PARAMETERS_MSG = "NO SPECIFIED PARAMETERS"
 
 class OraclePartialCorrTest(CIT_Base):
 
-    def __init__(self, DGM: LinearSCM, fake_data, **kwargs):
+    def __init__(self, DGM: LinearSCM, fake_data, rank_mode='numeric', **kwargs):
         super().__init__(fake_data, **kwargs)
         self.check_cache_method_consistent('OraclePartialCorrTest', NO_SPECIFIED_PARAMETERS_MSG)
         self.assert_input_data_is_valid()
 
 
         self.DGM = DGM
+        self.rank_mode = rank_mode
 
     def __call__(self, X, Y, condition_set=None):
                  
@@ -21,7 +22,10 @@ class OraclePartialCorrTest(CIT_Base):
         pcols = list(set.union(set(Xs),set(condition_set)))
         qcols = list(set.union(set(Ys),set(condition_set)))
 
-        rank = self.DGM.cross_covariance_rank_by_idx_in_xvars(pcols, qcols)
+        if self.rank_mode=='trek':
+            rank = self.DGM.trek_separation_rank_by_idx_in_xvars(pcols, qcols)
+        else:
+            rank = self.DGM.cross_covariance_rank_by_idx_in_xvars(pcols, qcols)
 
         if rank <= len(set(condition_set)):
             p=1
@@ -3,12 +3,26 @@ from DGM.LinearSCM import LinearSCM
 
 class OracleRankTest(object):
 
-    def __init__(self, DGM: LinearSCM):
+    def __init__(self, DGM: LinearSCM, rank_mode='numeric'):
+        """
+        rank_mode: 'numeric' takes the matrix rank of the true cross covariance,
+                   'trek' the generic rank from trek separation on the DAG
+                   (exact, and does not depend on the coefficient values).
+        """
 
         self.DGM = DGM
+        self.rank_mode = rank_mode
+
+    def rank(self, pcols, qcols):
+        if self.rank_mode=='trek':
+            return self.DGM.trek_separation_rank_by_idx_in_xvars(pcols, qcols)
+        elif self.rank_mode=='numeric':
+            return self.DGM.cross_covariance_rank_by_idx_in_xvars(pcols, qcols)
+        else:
+            raise NotImplementedError
 
     def __call__(self, pcols, qcols, r):
-        rank = self.DGM.cross_covariance_rank_by_idx_in_xvars(pcols, qcols)
+        rank = self.rank(pcols, qcols)
         if rank <= r:
             p=1
         else:
@@ -17,7 +31,7 @@ class OracleRankTest(object):
         return p
     
     def test(self, pcols, qcols, r, alpha):
-        rank = self.DGM.cross_covariance_rank_by_idx_in_xvars(pcols, qcols)
+        rank = self.rank(pcols, qcols)
         if rank <= r:
             p=1
         else:
@@ -26,3 +40,18 @@ class OracleRankTest(object):
         fail_to_reject = p>=alpha
 
         return fail_to_reject
+
+    def min_rank(self, pcols, qcols, kmax, alpha_dict):
+        rank = self.rank(pcols, qcols)
+
+        min_rank = None
+        for r in range(kmax, -1, -1):
+            p = 1 if rank <= r else 0
+            if not p>=alpha_dict[r]:
+                break
+            min_rank = r
+
+        return min_rank
+
+    def min_rank_batch(self, pairs, kmax, alpha_dict):
+        return [self.min_rank(pcols, qcols, kmax, alpha_dict) for pcols, qcols in pairs]
@@ -0,0 +1,104 @@
+import numpy as np
+from scipy.stats import norm, multivariate_normal
+from scipy.optimize import minimize_scalar
+from joblib import delayed, Parallel
+
+# stands in for +-inf thresholds in the bivariate normal cdf
+BOUND = 10.0
+
+
+def estimate_thresholds(x):
+    """
+    Two-step estimate of the latent normal thresholds of one ordinal
+    variable, from its cumulative marginal proportions.
+
+    Returns
+    -------
+    codes: x recoded to 0..K-1
+    thresholds: K+1 thresholds, with -BOUND and BOUND at the ends
+    """
+    levels, codes = np.unique(x, return_inverse=True)
+    props = np.bincount(codes, minlength=len(levels)) / len(codes)
+    inner = norm.ppf(np.cumsum(props)[:-1])
+    thresholds = np.concatenate([[-BOUND], np.clip(inner, -BOUND, BOUND), [BOUND]])
+    return codes, thresholds
+
+
+def _corner_grid(a, b):
+    A, B = np.meshgrid(a, b, indexing="ij")
+    return np.stack([A.ravel(), B.ravel()], axis=1)
+
+
+def cell_probabilities(a, b, rho):
+    """
+    Probabilities of the cells of an (len(a)-1) x (len(b)-1) table under a
+    standard bivariate normal with correlation rho cut at thresholds a, b.
+    """
+    corners = _corner_grid(a, b)
+    cdf = multivariate_normal.cdf(corners, mean=[0, 0], cov=[[1, rho], [rho, 1]])
+    cdf = cdf.reshape(len(a), len(b))
+    return cdf[1:, 1:] - cdf[:-1, 1:] - cdf[1:, :-1] + cdf[:-1, :-1]
+
+
+def polychoric_pair(codes_x, thresholds_x, codes_y, thresholds_y):
+    """
+    Two-step maximum likelihood polychoric correlation of one pair, given the
+    thresholds of each variable estimated beforehand.
+
+    Returns
+    -------
+    rho: the polychoric correlation
+    efficiency: ratio of the asymptotic variance of a Pearson correlation of
+        normal data, (1-rho^2)^2, to that of this estimate (from its Fisher
+        information), i.e. the fraction of N the estimate is worth
+    """
+    table = np.zeros((len(thresholds_x) - 1, len(thresholds_y) - 1))
+    np.add.at(table, (codes_x, codes_y), 1)
+
+    def negloglik(rho):
+        probs = np.maximum(cell_probabilities(thresholds_x, thresholds_y, rho), 1e-300)
+        return -(table * np.log(probs)).sum()
+
+    rho = minimize_scalar(negloglik, bounds=(-0.9999, 0.9999), method="bounded").x
+
+    # d pi_ij / d rho is the bivariate normal density summed over cell corners
+    corners = _corner_grid(thresholds_x, thresholds_y)
+    pdf = multivariate_normal.pdf(corners, mean=[0, 0], cov=[[1, rho], [rho, 1]])
+    pdf = pdf.reshape(len(thresholds_x), len(thresholds_y))
+    dprobs = pdf[1:, 1:] - pdf[:-1, 1:] - pdf[1:, :-1] + pdf[:-1, :-1]
+    probs = np.maximum(cell_probabilities(thresholds_x, thresholds_y, rho), 1e-300)
+    information = (dprobs * dprobs / probs).sum()
+    efficiency = min((1 - rho * rho) ** 2 * information, 1.0)
+
+    return rho, efficiency
+
+
+def polychoric_correlation_matrix(data, n_jobs=-1):
+    """
+    Full polychoric correlation matrix of ordinal data (N x p), with the
+    thresholds of each variable estimated once and the pairs fitted in
+    parallel.
+
+    Returns
+    -------
+    R: p x p polychoric correlation matrix
+    N_eff: effective sample size, N times the median efficiency over pairs,
+        to be used in place of N in Pearson-based rank tests
+    """
+    data = np.asarray(data)
+    N, p = data.shape
+    marginals = [estimate_thresholds(data[:, i]) for i in range(p)]
+
+    pairs = [(i, j) for i in range(p) for j in range(i + 1, p)]
+    output_list = Parallel(n_jobs=n_jobs, backend="loky")(
+        delayed(polychoric_pair)(*marginals[i], *marginals[j]) for i, j in pairs
+    )
+
+    R = np.eye(p)
+    efficiencies = []
+    for (i, j), (rho, efficiency) in zip(pairs, output_list):
+        R[i, j] = R[j, i] = rho
+        efficiencies.append(efficiency)
+
+    N_eff = N * np.median(efficiencies) if len(efficiencies) > 0 else N
+    return R, N_eff
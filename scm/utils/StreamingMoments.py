@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+
+class StreamingMoments(object):
+    """
+    Running mean and centred cross-products of a data matrix that is read in
+    row blocks, so that the raw data never has to be resident.
+
+    Blocks are merged with the pairwise (Chan et al.) form of Welford's
+    update, which stays accurate when the mean is large relative to the
+    spread. The statistics can be saved and reloaded, so one pass over a large
+    file serves many RLCD runs.
+    """
+
+    def __init__(self, n_vars=None, columns=None):
+        self.n = 0
+        self.mean = None if n_vars is None else np.zeros(n_vars)
+        self.M2 = None if n_vars is None else np.zeros((n_vars, n_vars))
+        self.columns = columns
+
+    def update(self, chunk):
+        """
+        Merge a block of rows (n_b x p) into the running statistics.
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        n_b = chunk.shape[0]
+        if n_b == 0:
+            return self
+
+        mean_b = chunk.mean(axis=0)
+        centred = chunk - mean_b
+        M2_b = centred.T @ centred
+
+        if self.n == 0:
+            self.n = n_b
+            self.mean = mean_b
+            self.M2 = M2_b
+            return self
+
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.M2 = self.M2 + M2_b + np.outer(delta, delta) * (self.n * n_b / n)
+        self.mean = self.mean + delta * (n_b / n)
+        self.n = n
+        return self
+
+    def covariance(self, ddof=0):
+        return self.M2 / (self.n - ddof)
+
+    def correlation(self):
+        sd = np.sqrt(np.diag(self.M2))
+        return self.M2 / np.outer(sd, sd)
+
+    def save(self, path):
+        columns = np.array([] if self.columns is None else list(self.columns), dtype=str)
+        np.savez(path, n=self.n, mean=self.mean, M2=self.M2, columns=columns)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            moments = cls()
+            moments.n = int(f["n"])
+            moments.mean = f["mean"]
+            moments.M2 = f["M2"]
+            columns = [str(c) for c in f["columns"]]
+            moments.columns = columns if len(columns) > 0 else None
+        return moments
+
+    @classmethod
+    def from_csv(cls, path, chunksize=100000, usecols=None, **read_csv_kwargs):
+        """
+        Accumulate the statistics of a CSV file, chunksize rows at a time.
+        """
+        moments = cls()
+        for chunk in pd.read_csv(path, chunksize=chunksize, usecols=usecols, **read_csv_kwargs):
+            if moments.columns is None:
+                moments.columns = list(chunk.columns)
+            moments.update(chunk.to_numpy())
+        return moments
+
+    @classmethod
+    def from_npy(cls, path, chunksize=100000, columns=None):
+        """
+        Accumulate the statistics of a 2-D .npy file through a read-only
+        memory map, chunksize rows at a time.
+        """
+        data = np.load(path, mmap_mode="r")
+        moments = cls(columns=columns)
+        for start in range(0, data.shape[0], chunksize):
+            moments.update(data[start:start + chunksize])
+        return moments
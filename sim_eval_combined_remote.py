@@ -77,6 +77,11 @@ def main_orchestrator():
         "RLCD": 0.01,
         "LaHME": 0.01
     }
+    # RLCD stops itself before the 300s cap and saves what it has found
+    worker_args = {
+        "RLCD": ["--time_budget", "280"],
+        "LaHME": [],
+    }
     scenario_classes = {
         "Measured1": Measured1, 
         "Measured2": Measured2, 
@@ -127,7 +132,7 @@ def main_orchestrator():
                         # Build the command for subprocess
                         python_executable = ['conda', 'run', '-n', conda_envs[method_name], 'python', '-u']
                         worker_path = os.path.join(SCRIPT_DIR, worker_script)
-                        command = [*python_executable, worker_path, temp_csv_input, temp_csv_output, str(current_alpha)]
+                        command = [*python_executable, worker_path, temp_csv_input, temp_csv_output, str(current_alpha), *worker_args[method_name]]
 
                         # 5-minute cap if GNU timeout/gtimeout is available
                         runner = shutil.which("timeout") or shutil.which("gtimeout")
@@ -135,6 +140,8 @@ def main_orchestrator():
 
                         # Run the external worker
                         result = subprocess.run(wrapped_command, capture_output=True, text=True, check=True)
+                        if "RLCD truncated" in result.stdout:
+                            print(f"      -> {method_name} reached its time budget, scoring the truncated result.", flush=True)
                         
                         # Load the result and clean up
                         estimated_adj_df = pd.read_csv(temp_csv_output, index_col=0)
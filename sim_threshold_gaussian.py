@@ -156,6 +156,11 @@ def main_orchestrator():
         "RLCD": 0.01,
         "LaHME": 0.01,
     }
+    # RLCD stops itself before the 300s cap and saves what it has found
+    worker_args = {
+        "RLCD": ["--time_budget", "280"],
+        "LaHME": [],
+    }
     scenario_classes = {
         "Simple_Case_Tree": Simple_Case_Tree,
         "Latent_Hierarchical_Structure": Latent_Hierarchical_Structure,
@@ -207,7 +212,7 @@ def main_orchestrator():
 
                             python_executable = ['conda', 'run', '-n', conda_envs[method_name], 'python', '-u']
                             worker_path = os.path.join(SCRIPT_DIR, worker_script)
-                            command = [*python_executable, worker_path, temp_csv_input, temp_csv_output, str(current_alpha)]
+                            command = [*python_executable, worker_path, temp_csv_input, temp_csv_output, str(current_alpha), *worker_args[method_name]]
 
                             # Serial run with hard 300s cap that kills the entire tree
                             t0 = time.time()
@@ -232,6 +237,8 @@ def main_orchestrator():
                                 continue
                             else: 
                                 ok += 1
+                                if out and "RLCD truncated" in out:
+                                    print(f"      -> {method_name} reached its time budget, scoring the truncated result.", flush=True)
 
                             # ensure output exists and is non-empty
                             if not (os.path.exists(temp_csv_output) and os.path.getsize(temp_csv_output) > 0):
@@ -0,0 +1,94 @@
+import os
+import sys
+import copy
+import pickle
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_dir, 'scm'))
+from StructureLearning.RLCD.Cover import Cover, setLength, setDifference, setOverlap, deduplicate, pairwiseOverlap, getVars
+from StructureLearning.RLCD.LatentGroups import LatentGroups
+
+
+def test_cover_interning_and_pickling():
+    A = Cover(['X1', 'X2'])
+    B = Cover({'X2', 'X1'}, atomic=False)
+    assert A == B and hash(A) == hash(B)
+    assert A.vars is B.vars and A.bits == B.bits
+    assert hash(A) == hash("X1X2")
+
+    C = pickle.loads(pickle.dumps(B))
+    assert C == A and hash(C) == hash(A) and C.bits == A.bits
+    assert not C.atomic
+
+    # union moves the Cover to the interned set of the new variables
+    A.union(Cover('X3'))
+    assert A == Cover(['X1', 'X2', 'X3']) and hash(A) == hash("X1X2X3")
+    assert A != B
+
+
+def test_cover_set_functions_match_variable_sets():
+    rng = np.random.default_rng(0)
+    names = [f"V{i}" for i in range(10)]
+    for _ in range(200):
+        As = {Cover(list(rng.choice(names, rng.integers(1, 4), replace=False))) for _ in range(rng.integers(1, 4))}
+        Bs = {Cover(list(rng.choice(names, rng.integers(1, 4), replace=False))) for _ in range(rng.integers(1, 4))}
+
+        assert setLength(As) == len(getVars(As))
+        assert setDifference(As, Bs) == {A for A in As - Bs if not A.vars & getVars(Bs)}
+        assert setOverlap(As, Bs) == (len(getVars(As) & getVars(Bs)) > 0)
+        assert deduplicate(As) == {A for A in As if not any(A.vars < B.vars for B in As)}
+        assert pairwiseOverlap(As) == any(A.vars & B.vars for A in As for B in As if A is not B)
+
+
+def names(Vs):
+    return sorted(str(V) for V in Vs)
+
+
+def queries(G):
+    """
+    Every cached query of G, for all Covers in the graph.
+    """
+    out = {}
+    for L in list(G.latentDict) + list(G.X):
+        out[str(L)] = (names(G.findChildren(L)), names(G.findChildren(L, rigorous=False)), names(G.findDescendants(L)), \
+                       names(G.findDescendants(L, rigorous=False)), names(G.pickAllMeasures({L})), names(G.findParents(L)))
+    return out
+
+
+def assert_caches_fresh(G):
+    # deep copies start with empty caches, so they answer from latentDict
+    assert queries(G) == queries(copy.deepcopy(G))
+    G.checkParentIndex()
+
+
+def test_latent_groups_caches_follow_mutations():
+    xvars = [f"X{i}" for i in range(1, 8)]
+    G = LatentGroups(X=xvars, Xns=xvars, all_nb_set=set(), nb_set_dict={x: set() for x in xvars}, \
+                     local_Adj=np.ones((len(xvars), len(xvars))))
+    X = G.X_dict
+    L1, L2, L3 = [Cover(name, is_observed=False) for name in ['L1', 'L2', 'L3']]
+
+    G.addOrUpdateCover(L1, {X['X1'], X['X2'], X['X3']})
+    G.addOrUpdateCover(L2, {X['X4'], X['X5'], X['X6']})
+    assert_caches_fresh(G)
+
+    mutations = [
+        lambda: G.addOrUpdateCover(L3, {L1, L2}),
+        lambda: G.addOrUpdateCover(L2, {X['X7']}),
+        lambda: G.disconnectNodes({L3}, {L2}),
+        lambda: G.reverseParentage(L1, L3),
+        lambda: G.makeRoot(L3),
+        lambda: G.removeCover(L2),
+    ]
+    before = queries(G)
+    for mutate in mutations:
+        queries(G) # fill the caches
+        mutate()
+        assert_caches_fresh(G)
+        after = queries(G)
+        assert after != before
+        before = after
+
+    assert names(G.findDescendants(L3)) == ['L1', 'X1', 'X2', 'X3']
+    assert names(G.findParents(L1)) == ['L3']
@@ -0,0 +1,47 @@
+import os
+import sys
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_dir, 'scm'))
+from utils.PolychoricCorrelation import estimate_thresholds, polychoric_pair, polychoric_correlation_matrix
+from utils.Chi2RankTest import Chi2RankTest
+
+
+def ordinal_data(R, N=4000, seed=0):
+    """
+    Normal data with correlation R, cut into four unevenly spaced levels.
+    """
+    rng = np.random.default_rng(seed)
+    Z = rng.multivariate_normal(np.zeros(len(R)), R, size=N)
+    return np.digitize(Z, [-1.0, 0.2, 0.9])
+
+
+def test_thresholds():
+    data = ordinal_data(np.eye(2), N=20000)
+    codes, thresholds = estimate_thresholds(data[:, 0])
+    assert codes.min() == 0 and codes.max() == 3
+    np.testing.assert_allclose(thresholds[1:-1], [-1.0, 0.2, 0.9], atol=0.05)
+
+
+def test_polychoric_pair_recovers_correlation():
+    for rho in [0.0, 0.4, -0.7]:
+        data = ordinal_data(np.array([[1, rho], [rho, 1]]))
+        estimate, efficiency = polychoric_pair(*estimate_thresholds(data[:, 0]), *estimate_thresholds(data[:, 1]))
+        assert abs(estimate - rho) < 0.05
+        assert 0 < efficiency <= 1
+
+
+def test_polychoric_matrix_and_rank_test():
+    R = np.array([[1, 0.5, 0.3], [0.5, 1, 0.4], [0.3, 0.4, 1]])
+    data = ordinal_data(R)
+    estimate, N_eff = polychoric_correlation_matrix(data, n_jobs=1)
+
+    np.testing.assert_allclose(estimate, estimate.T)
+    np.testing.assert_allclose(np.diag(estimate), 1)
+    np.testing.assert_allclose(estimate, R, atol=0.05)
+    assert 0 < N_eff < len(data)
+
+    test = Chi2RankTest.from_ordinal(data, n_jobs=1)
+    assert test.N == N_eff
+    assert not test.test([0], [1], 0, 0.01)
@@ -0,0 +1,180 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_dir, 'scm'))
+from utils.Chi2RankTest import Chi2RankTest
+from utils.DeterminantRankTest import DeterminantRankTest
+from utils.StreamingMoments import StreamingMoments
+
+ALPHA_DICT = {0: 0.01, 1: 0.01, 2: 0.01, 3: 0.01}
+
+
+def one_factor_data(N=20000, n_indicators=6, seed=0):
+    """
+    Indicators 0..n_indicators-1 of one latent factor, then two independent
+    columns.
+    """
+    rng = np.random.default_rng(seed)
+    L = rng.normal(size=N)
+    X = np.outer(L, rng.uniform(1, 2, size=n_indicators)) + rng.normal(size=(N, n_indicators))
+    return np.hstack([X, rng.normal(size=(N, 2))])
+
+
+@pytest.mark.parametrize("pcols, qcols, r", [
+    ([0, 2], [1, 2], 1),
+    ([0, 4], [1, 4], 1),
+    ([0, 3], [2, 3], 1),
+    ([0, 2, 4], [1, 2, 4], 2),
+])
+def test_determinant_overlapping_cols(pcols, qcols, r):
+    # columns 0 and 1 strongly correlated, the others independent
+    rng = np.random.default_rng(0)
+    z = rng.normal(size=5000)
+    X = rng.normal(size=(5000, 5))
+    X[:, 0] = z + 0.3 * rng.normal(size=5000)
+    X[:, 1] = z + 0.3 * rng.normal(size=5000)
+
+    det = DeterminantRankTest(X)
+    chi2 = Chi2RankTest(X)
+    assert det.test(pcols, qcols, r, 0.01) == chi2.test(pcols, qcols, r, 0.01)
+    assert det.min_rank(pcols, qcols, r, ALPHA_DICT) == chi2.min_rank(pcols, qcols, r, ALPHA_DICT)
+
+
+@pytest.mark.parametrize("pcols, qcols", [
+    ([0, 1], [2, 3]),
+    ([0, 1, 6], [2, 3, 6]),
+    ([0, 1, 2], [3, 4, 2]),
+    ([0, 6], [1, 7]),
+    ([0, 1, 2, 5], [3, 4, 2, 5]),
+])
+def test_determinant_min_rank_one_factor(pcols, qcols):
+    X = one_factor_data()
+    det = DeterminantRankTest(X)
+    chi2 = Chi2RankTest(X)
+    kmax = min(len(pcols), len(qcols)) - 1
+    assert det.min_rank(pcols, qcols, kmax, ALPHA_DICT) == chi2.min_rank(pcols, qcols, kmax, ALPHA_DICT)
+
+
+def reference_cancorr(X, pcols, qcols):
+    """
+    Canonical correlations straight from the data, as the singular values of
+    Qx.T @ Qy for orthonormal bases of the centred column blocks.
+    """
+    X = X - X.mean(axis=0)
+    Qx, _ = np.linalg.qr(X[:, pcols])
+    Qy, _ = np.linalg.qr(X[:, qcols])
+    return np.clip(np.linalg.svd(Qx.T @ Qy, compute_uv=False), 0, 1)
+
+
+CANCORR_PAIRS = [
+    ([0, 1], [2, 3]),
+    ([0, 1, 2], [3, 4, 5]),
+    ([0, 6], [1, 7]),
+    ([0, 1, 6], [2, 3, 6]),
+    ([0, 1, 2, 5], [3, 4, 2, 5]),
+    ([3, 0], [7, 1, 2]),
+]
+
+
+@pytest.mark.parametrize("pcols, qcols", CANCORR_PAIRS)
+def test_cancorr_matches_data(pcols, qcols):
+    X = one_factor_data(N=2000)
+    test = Chi2RankTest(X)
+    np.testing.assert_allclose(test.cancorr(pcols, qcols), reference_cancorr(X, pcols, qcols), atol=1e-8)
+
+
+def test_cancorr_cache_and_batch():
+    X = one_factor_data(N=2000)
+    test = Chi2RankTest(X)
+    batch = Chi2RankTest(X).get_cancorr_batch(CANCORR_PAIRS + [(qcols, pcols) for pcols, qcols in CANCORR_PAIRS])
+    for i, (pcols, qcols) in enumerate(CANCORR_PAIRS):
+        expected = test.cancorr(pcols, qcols)
+        np.testing.assert_allclose(test.get_cancorr(pcols, qcols), expected, atol=1e-10)
+        # (q, p) shares the entry of (p, q)
+        np.testing.assert_allclose(test.get_cancorr(qcols, pcols), expected, atol=1e-10)
+        np.testing.assert_allclose(batch[i], expected, atol=1e-10)
+        np.testing.assert_allclose(batch[i + len(CANCORR_PAIRS)], expected, atol=1e-10)
+
+
+def reference_min_rank(test, pcols, qcols, kmax, alpha_dict):
+    min_rank = None
+    for r in range(kmax, -1, -1):
+        if not test.test(pcols, qcols, r, alpha_dict[r]):
+            break
+        min_rank = r
+    return min_rank
+
+
+@pytest.mark.parametrize("pcols, qcols", CANCORR_PAIRS)
+def test_min_rank_matches_tests(pcols, qcols):
+    X = one_factor_data(N=2000)
+    kmax = min(len(pcols), len(qcols)) - 1
+    for screen in [True, False]:
+        test = Chi2RankTest(X)
+        test.screen = screen
+        assert test.min_rank(pcols, qcols, kmax, ALPHA_DICT) == reference_min_rank(Chi2RankTest(X), pcols, qcols, kmax, ALPHA_DICT)
+
+
+def test_min_rank_batch_matches_min_rank():
+    X = one_factor_data(N=2000)
+    for kmax in [0, 1]:
+        pairs = [(pcols, qcols) for pcols, qcols in CANCORR_PAIRS if min(len(pcols), len(qcols)) > kmax]
+        expected = [Chi2RankTest(X).min_rank(pcols, qcols, kmax, ALPHA_DICT) for pcols, qcols in pairs]
+        assert Chi2RankTest(X).min_rank_batch(pairs, kmax, ALPHA_DICT) == expected
+        assert DeterminantRankTest(X).min_rank_batch(pairs, kmax, ALPHA_DICT) == \
+            [DeterminantRankTest(X).min_rank(pcols, qcols, kmax, ALPHA_DICT) for pcols, qcols in pairs]
+
+
+def test_streaming_moments_match_data(tmp_path):
+    # a large mean, where a naive sum of squares loses the covariance
+    X = one_factor_data(N=3000) + 1e6
+    moments = StreamingMoments()
+    for start in range(0, len(X), 700):
+        moments.update(X[start:start + 700])
+
+    assert moments.n == len(X)
+    np.testing.assert_allclose(moments.mean, X.mean(axis=0), rtol=1e-12)
+    np.testing.assert_allclose(moments.covariance(), np.cov(X, rowvar=False, ddof=0), atol=1e-8)
+
+    np.save(tmp_path / "data.npy", X)
+    np.testing.assert_allclose(StreamingMoments.from_npy(tmp_path / "data.npy", chunksize=1000).covariance(), moments.covariance(), atol=1e-8)
+
+    moments.save(tmp_path / "moments.npz")
+    loaded = StreamingMoments.load(tmp_path / "moments.npz")
+    assert loaded.n == moments.n
+    np.testing.assert_array_equal(loaded.M2, moments.M2)
+
+
+def test_rank_test_from_sufficient_statistics():
+    X = one_factor_data(N=3000)
+    moments = StreamingMoments().update(X[:1000]).update(X[1000:])
+    from_data = Chi2RankTest(X)
+    for test in [Chi2RankTest.from_covariance(np.cov(X, rowvar=False), len(X)), Chi2RankTest.from_moments(moments)]:
+        assert test.N == from_data.N
+        for pcols, qcols in CANCORR_PAIRS:
+            np.testing.assert_allclose(test.cancorr(pcols, qcols), from_data.cancorr(pcols, qcols), atol=1e-8)
+            kmax = min(len(pcols), len(qcols)) - 1
+            assert test.min_rank(pcols, qcols, kmax, ALPHA_DICT) == from_data.min_rank(pcols, qcols, kmax, ALPHA_DICT)
+
+
+def test_screen_only_rejects_what_the_exact_test_rejects():
+    X = one_factor_data(N=2000)
+    rng = np.random.default_rng(1)
+    screened = Chi2RankTest(X)
+    screened.screen_verify = True
+    exact = Chi2RankTest(X)
+    exact.screen = False
+
+    for _ in range(300):
+        cols = rng.permutation(X.shape[1])
+        p, q, s = rng.integers(1, 4), rng.integers(1, 4), rng.integers(0, 3)
+        pcols = list(cols[:p]) + list(cols[p + q:p + q + s])
+        qcols = list(cols[p:p + q]) + list(cols[p + q:p + q + s])
+        kmax = int(rng.integers(0, min(len(pcols), len(qcols), len(ALPHA_DICT))))
+        assert screened.min_rank(pcols, qcols, kmax, ALPHA_DICT) == exact.min_rank(pcols, qcols, kmax, ALPHA_DICT)
+
+    assert screened.screen_counts['screen_rejections'] > 0
+    assert screened.screen_counts['screen_mismatches'] == 0
@@ -0,0 +1,61 @@
+import os
+import sys
+import logging
+import numpy as np
+import pytest
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_dir, 'scm'))
+from simulation_scenarios import Latent_Hierarchical_Structure
+import StructureLearning.RLCD.RLCD_alg as RLCD_alg
+from StructureLearning.RLCD.RLCD_alg import RLCD, resumeRLCD
+from utils.Chi2RankTest import Chi2RankTest
+from utils.logger import LOGGER
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture(scope="module")
+def scenario():
+    LOGGER.setLevel(logging.WARNING)
+    dgm = Latent_Hierarchical_Structure(seed=0)
+    df_x, _ = dgm.generate_data(N=2000)
+    return dgm.xvars, df_x
+
+
+def rlcd_parameters(df_x, **kwargs):
+    parameters = {"ranktest_method": Chi2RankTest(df_x.to_numpy(), 1), "citest_method": None, "stage1_method": "all", \
+                  "alpha_dict": {0: 0.01, 1: 0.01, 2: 0.01, 3: 0.01}, "n_jobs": 1}
+    parameters.update(kwargs)
+    return parameters
+
+
+def test_resume_matches_uninterrupted_run(scenario, tmp_path, monkeypatch):
+    xvars, df_x = scenario
+    path = str(tmp_path / "rlcd.ckpt")
+    full = RLCD(True, xvars, df_x, rlcd_parameters(df_x, checkpoint_path=path))
+    # the checkpoint is renamed into place, no temporary file is left
+    assert os.listdir(tmp_path) == ["rlcd.ckpt"]
+    assert len(full[3]) > len(xvars)
+
+    save_checkpoint = RLCD_alg.saveCheckpoint
+    for stop_after in [1, 2, 4]:
+        os.remove(path)
+        writes = []
+
+        def interrupting_save(parameters, G, k, unfold_index):
+            save_checkpoint(parameters, G, k, unfold_index)
+            writes.append(k)
+            if len(writes) == stop_after:
+                raise Interrupted()
+
+        monkeypatch.setattr(RLCD_alg, "saveCheckpoint", interrupting_save)
+        with pytest.raises(Interrupted):
+            RLCD(True, xvars, df_x, rlcd_parameters(df_x, checkpoint_path=path))
+        monkeypatch.setattr(RLCD_alg, "saveCheckpoint", save_checkpoint)
+
+        resumed = resumeRLCD(path, True, xvars, df_x, rlcd_parameters(df_x))
+        np.testing.assert_array_equal(resumed[2], full[2])
+        assert resumed[3] == full[3]
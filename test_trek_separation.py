@@ -0,0 +1,89 @@
+import os
+import sys
+import numpy as np
+import pytest
+from itertools import combinations
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_dir, 'scm'))
+from LinearSCM import LinearSCM
+from DGM.LinearSCM import LinearSCM as ScmLinearSCM
+
+
+def small_dgm(cls):
+    """
+    Two latents over six measures, with an edge between the latents, one
+    between two measures of different latents and a collider X7.
+    """
+    dgm = cls(seed=0)
+    for name in ['L1', 'L2']:
+        dgm.add_variable(name, False)
+    for j in range(1, 8):
+        dgm.add_variable(f"X{j}", True)
+    for pa, ch in [('L1', 'X1'), ('L1', 'X2'), ('L1', 'X3'), ('L1', 'L2'), ('L2', 'X4'), ('L2', 'X5'), ('L2', 'X6'), \
+                   ('X3', 'X4'), ('X1', 'X7'), ('X6', 'X7')]:
+        dgm.add_edge(pa, ch)
+    return dgm
+
+
+def enumerated_trek_rank(dgm, pcols, qcols):
+    """
+    Smallest |C_A| + |C_B| such that every trek from pcols to qcols has its
+    left side through C_A or its right side through C_B, by enumerating the
+    treks and the candidate sets.
+    """
+    n = len(dgm.vars)
+    P = {dgm.vars.index(dgm.xvars[i]) for i in pcols}
+    Q = {dgm.vars.index(dgm.xvars[i]) for i in qcols}
+
+    def paths_from(top):
+        paths = [(top,)]
+        for path in paths:
+            paths.extend(path + (int(ch),) for ch in np.nonzero(dgm.F[path[-1]])[0])
+        return paths
+
+    treks = []
+    for top in range(n):
+        paths = paths_from(top)
+        for left in paths:
+            for right in paths:
+                if left[-1] in P and right[-1] in Q:
+                    treks.append((set(left), set(right)))
+
+    for size in range(min(len(P), len(Q)) + 1):
+        for a in range(size + 1):
+            for CA in combinations(range(n), a):
+                for CB in combinations(range(n), size - a):
+                    if all(left & set(CA) or right & set(CB) for left, right in treks):
+                        return size
+
+
+def disjoint_pairs(n_xvars):
+    pairs = []
+    for p in range(1, 4):
+        for pcols in combinations(range(n_xvars), p):
+            rest = [i for i in range(n_xvars) if i not in pcols]
+            for qcols in combinations(rest, p):
+                pairs.append((list(pcols), list(qcols)))
+    return pairs
+
+
+@pytest.mark.parametrize("cls", [LinearSCM, ScmLinearSCM])
+def test_trek_rank_matches_enumeration(cls):
+    dgm = small_dgm(cls)
+    rng = np.random.default_rng(0)
+    pairs = disjoint_pairs(len(dgm.xvars))
+    for i in rng.choice(len(pairs), 200, replace=False):
+        pcols, qcols = pairs[i]
+        assert dgm.trek_separation_rank_by_idx_in_xvars(pcols, qcols) == enumerated_trek_rank(dgm, pcols, qcols)
+
+
+@pytest.mark.parametrize("cls", [LinearSCM, ScmLinearSCM])
+def test_trek_rank_follows_edge_changes(cls):
+    dgm = small_dgm(cls)
+    pcols, qcols = [0, 1], [4, 5] # {X1, X2} and {X5, X6}
+    assert dgm.trek_separation_rank_by_idx_in_xvars(pcols, qcols) == 1
+
+    # a second path, X2 -> X5, lifts the rank to 2
+    dgm.add_edge('X2', 'X5')
+    assert dgm.trek_separation_rank_by_idx_in_xvars(pcols, qcols) == enumerated_trek_rank(dgm, pcols, qcols) == 2